@@ -1,23 +1,36 @@
 import os
 import json
+import base64
 import boto3
 import time
 import asyncio
 import csv
+import logging
 import hashlib
+import random
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.eventstream import EventStreamBuffer
 from fastapi import FastAPI, HTTPException, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, AsyncIterator
+from string import Template
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote
+import httpx
+import bcrypt
 import redis  # NEW: Redis for shared sessions
 
+logger = logging.getLogger(__name__)
+
 # --- TOKEN COUNTER ---
 try:
     import tiktoken
@@ -26,6 +39,7 @@ except:
     print("tiktoken not found. Install: pip install tiktoken")
     encoder = None
 
+@lru_cache(maxsize=4096)
 def count_tokens(text: str) -> int:
     if not encoder:
         return len(text.split()) * 1.3
@@ -34,25 +48,51 @@ def count_tokens(text: str) -> int:
     except:
         return len(text.split()) * 1.3
 
+# --- FAST JSON ---
+try:
+    import orjson
+    fast_dumps = orjson.dumps  # returns bytes
+    fast_loads = orjson.loads  # accepts bytes or str
+except ImportError:
+    print("orjson not found. Install: pip install orjson")
+
+    def fast_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+    fast_loads = json.loads
+
 # --- INITIALIZATION ---
 load_dotenv()
-executor = ThreadPoolExecutor(max_workers=10)
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+# CSV / filesystem work and bcrypt (C, releases the GIL: one thread per core keeps it parallel)
+executor = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1))
+
+# --- AWS Bedrock (native async HTTP, SigV4-signed) ---
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+BEDROCK_MAX_ATTEMPTS = 3
+# Defined up front so callers reach the "Bedrock not ready" guard when setup fails
+BEDROCK_INVOKE_URL = BEDROCK_STREAM_URL = None
 
-# --- AWS Bedrock ---
 try:
     AWS_REGION = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
     if not AWS_REGION:
         raise Exception("AWS_REGION not set")
 
-    retry_config = Config(
-        retries={'max_attempts': 3, 'mode': 'standard'},
-        max_pool_connections=100,
-        connect_timeout=5,
-        read_timeout=30
+    bedrock_credentials = boto3.Session().get_credentials()
+    if not bedrock_credentials:
+        raise Exception("AWS credentials not found")
+
+    BEDROCK_MODEL_URL = f"https://bedrock-runtime.{AWS_REGION}.amazonaws.com/model/{quote(MODEL_ID, safe='')}"
+    BEDROCK_INVOKE_URL = f"{BEDROCK_MODEL_URL}/invoke"
+    BEDROCK_STREAM_URL = f"{BEDROCK_MODEL_URL}/invoke-with-response-stream"
+    bedrock_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("BEDROCK_POOL_SIZE", "200")),
+            max_keepalive_connections=100
+        ),
+        timeout=httpx.Timeout(30, connect=5)
     )
-
-    bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=retry_config)
-    MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
     print(f"Bedrock ready: {AWS_REGION} | Model: {MODEL_ID}")
 
 except Exception as e:
@@ -73,80 +113,303 @@ app.add_middleware(
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# --- USER DATABASE (CSV) ---
+# --- REDIS (sessions + users) ---
+try:
+    # Bounded pool: callers wait up to 1s for a free connection instead of opening new sockets
+    redis_pool = redis.BlockingConnectionPool(
+        host='127.0.0.1',
+        port=6379,
+        db=0,
+        max_connections=int(os.getenv("REDIS_POOL_SIZE", "100")),
+        timeout=1.0,
+        socket_keepalive=True,
+        health_check_interval=30,
+        decode_responses=True
+    )
+    redis_client = redis.Redis(connection_pool=redis_pool)
+    redis_client.ping()  # Test connection
+    print("Redis connected for sessions")
+except Exception as e:
+    # In-memory sessions are per-process and break with multiple workers
+    if os.getenv("REQUIRE_REDIS", "").lower() in ("1", "true", "yes"):
+        raise RuntimeError(f"Redis is required but unavailable: {e}")
+    print(f"Redis failed: {e}. Falling back to in-memory (NOT FOR PRODUCTION)")
+    redis_client = None
+    active_sessions = {}  # Fallback (only for dev)
+    _sessions_lock = threading.Lock()
+
+# --- USER DATABASE (Redis hashes, CSV snapshot) ---
 USER_DB_FILE = "users.csv"
+USER_FIELDS = ['email', 'password_hash', 'full_name', 'created_at']
+USER_INDEX_KEY = "users:bycreate"  # ZSET email -> created_at timestamp
+LEGACY_USER_INDEX_KEY = "users:index"
+USER_LIST_FIELDS = ['email', 'full_name', 'created_at', 'password_hint']
+USER_MIGRATED_KEY = "users:migrated"
+USER_DUMP_INTERVAL = 60  # seconds between users.csv snapshots
+USER_SNAPSHOT_KEY = "users:csv:mtime"  # when any worker last wrote users.csv
+USER_FLUSH_INTERVAL = 0.5  # seconds between batched signup appends (no-Redis mode)
+USER_WRITE_BUFFER = 1 << 16
+
+# Set by init_user_db(); the file is only ever replaced atomically after that
+_USER_DB_READY = False
+
+# Signups waiting to be appended to users.csv by _flush_users (no-Redis mode)
+_pending_users: List[List[str]] = []
+
+def _user_key(email: str) -> str:
+    return f"user:{email}"
+
+def _created_score(created_at: str) -> float:
+    try:
+        return datetime.fromisoformat(created_at).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def _password_hint(password_hash: str) -> str:
+    # Partial hash shown on the admin list, stored so listing never reads the full hash
+    return password_hash[:10] + '...'
+
+def _read_users_csv() -> List[Dict]:
+    pending = [dict(zip(USER_FIELDS, row)) for row in _pending_users]
+    if not _USER_DB_READY:
+        return pending
+    with open(USER_DB_FILE, 'r', newline='') as f:
+        return list(csv.DictReader(f)) + pending
+
+def _take_pending_users() -> List[List[str]]:
+    batch = _pending_users[:]
+    del _pending_users[:len(batch)]
+    return batch
+
+def _append_user_rows(rows: List[List[str]]):
+    """Append a batch of rows with one open/flush/fsync"""
+    if not rows:
+        return
+    with open(USER_DB_FILE, 'a', newline='', buffering=USER_WRITE_BUFFER) as f:
+        csv.writer(f).writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
 
 def init_user_db():
-    """Initialize users CSV file if it doesn't exist"""
+    """Initialize users CSV file and migrate it into Redis once"""
+    global _USER_DB_READY
     if not os.path.exists(USER_DB_FILE):
         with open(USER_DB_FILE, 'w', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow(['email', 'password_hash', 'full_name', 'created_at'])
+            writer.writerow(USER_FIELDS)
+    _USER_DB_READY = True
+
+    if redis_client and redis_client.set(USER_MIGRATED_KEY, datetime.now().isoformat(), nx=True):
+        rows = _read_users_csv()
+        pipe = redis_client.pipeline()
+        for row in rows:
+            mapping = {k: row[k] for k in USER_FIELDS}
+            mapping['password_hint'] = _password_hint(row['password_hash'])
+            pipe.hset(_user_key(row['email']), mapping=mapping)
+            pipe.zadd(USER_INDEX_KEY, {row['email']: _created_score(row['created_at'])})
+        pipe.execute()
+        print(f"Migrated {len(rows)} users from {USER_DB_FILE} to Redis")
+
+    if redis_client and redis_client.exists(LEGACY_USER_INDEX_KEY):
+        # Move users indexed by the old unsorted SET into the created_at ZSET
+        emails = list(redis_client.smembers(LEGACY_USER_INDEX_KEY))
+        pipe = redis_client.pipeline()
+        for email in emails:
+            pipe.hmget(_user_key(email), ['created_at', 'password_hash'])
+        reindex = redis_client.pipeline()
+        for email, (created_at, password_hash) in zip(emails, pipe.execute()):
+            if password_hash is None:
+                continue
+            reindex.hset(_user_key(email), 'password_hint', _password_hint(password_hash))
+            reindex.zadd(USER_INDEX_KEY, {email: _created_score(created_at)})
+        reindex.delete(LEGACY_USER_INDEX_KEY)
+        reindex.execute()
+
+AUTH_CACHE_TTL = 300  # seconds a verified login skips bcrypt
 
 def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
+    """Hash password using bcrypt"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+
+def _legacy_hash(password: str) -> str:
+    # Unsalted SHA256 used before bcrypt; still accepted and upgraded on login
     return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_user(email: str, password: str) -> bool:
-    """Verify user credentials"""
-    if not os.path.exists(USER_DB_FILE):
+def _check_password(password: str, stored_hash: Optional[str]) -> bool:
+    if not stored_hash:
         return False
+    if stored_hash.startswith("$2"):
+        return bcrypt.checkpw(password.encode(), stored_hash.encode())
+    return stored_hash == _legacy_hash(password)
 
-    password_hash = hash_password(password)
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email and row['password_hash'] == password_hash:
-                return True
+def _auth_cache_key(stored_hash: str, password: str) -> str:
+    # Bound to the stored hash, not just the email: a password change, upgrade or
+    # delete + re-signup gives a new (salted) hash, so old entries can never match again
+    return "authcache:" + hashlib.sha256(f"{stored_hash}\0{password}".encode()).hexdigest()
+
+def verify_user(email: str, password: str) -> bool:
+    """Verify user credentials (blocking: run in executor)"""
+    if redis_client:
+        key = _user_key(email)
+        stored_hash = redis_client.hget(key, 'password_hash')
+        if not stored_hash:
+            return False
+        if redis_client.get(_auth_cache_key(stored_hash, password)):
+            return True
+        if not _check_password(password, stored_hash):
+            return False
+        if not stored_hash.startswith("$2"):
+            stored_hash = hash_password(password)
+            redis_client.hset(key, mapping={'password_hash': stored_hash, 'password_hint': _password_hint(stored_hash)})
+        redis_client.setex(_auth_cache_key(stored_hash, password), AUTH_CACHE_TTL, "1")
+        return True
+
+    for row in _read_users_csv():
+        if row['email'] == email:
+            return _check_password(password, row['password_hash'])
     return False
 
 def user_exists(email: str) -> bool:
     """Check if user already exists"""
-    if not os.path.exists(USER_DB_FILE):
-        return False
+    if redis_client:
+        return bool(redis_client.exists(_user_key(email)))
 
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email:
-                return True
-    return False
+    return any(row['email'] == email for row in _read_users_csv())
 
 def create_user(email: str, password: str, full_name: str) -> bool:
-    """Create new user"""
+    """Create new user (blocking: run in executor)"""
+    password_hash = hash_password(password)
+    created_at = datetime.now().isoformat()
+
+    if redis_client:
+        key = _user_key(email)
+        # HSETNX on the email field is the atomic uniqueness guard
+        if not redis_client.hsetnx(key, 'email', email):
+            return False
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={
+            'password_hash': password_hash,
+            'password_hint': _password_hint(password_hash),
+            'full_name': full_name,
+            'created_at': created_at
+        })
+        pipe.zadd(USER_INDEX_KEY, {email: _created_score(created_at)})
+        pipe.execute()
+        return True
+
     if user_exists(email):
         return False
-
-    password_hash = hash_password(password)
-    with open(USER_DB_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([email, password_hash, full_name, datetime.now().isoformat()])
+    _pending_users.append([email, password_hash, full_name, created_at])
     return True
 
+def list_users(offset: int = 0, limit: Optional[int] = None, fields: List[str] = USER_FIELDS) -> List[Dict]:
+    """Return user records newest first (Redis ZSET index or CSV); fields[0] must be 'email'"""
+    if limit is not None and limit <= 0:
+        # ZREVRANGE would read stop=-1 (or any negative) as "to the end" and return everyone
+        return []
+    if not redis_client:
+        rows = _read_users_csv()[::-1]
+        for row in rows:
+            row['password_hint'] = _password_hint(row['password_hash'])
+        end = None if limit is None else offset + limit
+        return [{f: row[f] for f in fields} for row in rows[offset:end]]
+
+    stop = -1 if limit is None else offset + limit - 1
+    emails = redis_client.zrevrange(USER_INDEX_KEY, offset, stop)
+    pipe = redis_client.pipeline()
+    for email in emails:
+        pipe.hmget(_user_key(email), fields)
+    return [dict(zip(fields, values)) for values in pipe.execute() if values[0] is not None]
+
+def count_users() -> int:
+    if not redis_client:
+        return len(_read_users_csv())
+    return redis_client.zcard(USER_INDEX_KEY)
+
+def _write_users_csv(users: List[Dict]):
+    """Rewrite users.csv via temp file + fsync + os.replace, so a crash never leaves it half-written"""
+    tmp = USER_DB_FILE + ".tmp"
+    with open(tmp, 'w', newline='', buffering=USER_WRITE_BUFFER) as f:
+        writer = csv.DictWriter(f, fieldnames=USER_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(users)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, USER_DB_FILE)
+
+def dump_users_csv():
+    """Snapshot Redis users into users.csv (atomic replace)"""
+    if not redis_client:
+        return
+    _write_users_csv(sorted(list_users(), key=lambda u: u.get('created_at', '')))
+    redis_client.set(USER_SNAPSHOT_KEY, time.time())
+
+_snapshot_pending = False
+
+async def refresh_users_snapshot():
+    """Regenerate users.csv in the background unless a refresh is already running"""
+    global _snapshot_pending
+    if _snapshot_pending:
+        return
+    _snapshot_pending = True
+    try:
+        await asyncio.get_running_loop().run_in_executor(executor, dump_users_csv)
+    except Exception as e:
+        print(f"User CSV dump failed: {e}")
+    finally:
+        _snapshot_pending = False
+
+async def _dump_users_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(USER_DUMP_INTERVAL)
+        try:
+            await loop.run_in_executor(executor, dump_users_csv)
+        except Exception as e:
+            print(f"User CSV dump failed: {e}")
+
+async def _flush_users():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        batch = _take_pending_users()
+        if not batch:
+            continue
+        try:
+            await loop.run_in_executor(executor, _append_user_rows, batch)
+        except Exception as e:
+            print(f"User CSV append failed: {e}")
+            _pending_users[:0] = batch
+
+@app.on_event("startup")
+async def start_user_dump():
+    if redis_client:
+        asyncio.create_task(_dump_users_periodically())
+    else:
+        asyncio.create_task(_flush_users())
+
+@app.on_event("shutdown")
+async def final_user_dump():
+    try:
+        _append_user_rows(_take_pending_users())
+        dump_users_csv()
+    except Exception as e:
+        print(f"User CSV dump failed: {e}")
+
 # Initialize DB on startup
 init_user_db()
 
-# --- REDIS SESSION MANAGEMENT ---
-try:
-    redis_client = redis.Redis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
-    redis_client.ping()  # Test connection
-    print("Redis connected for sessions")
-except Exception as e:
-    print(f"Redis failed: {e}. Falling back to in-memory (NOT FOR PRODUCTION)")
-    redis_client = None
-    active_sessions = {}  # Fallback (only for dev)
+SESSION_TTL = 86400
 
 def create_session(email: str) -> str:
     """Create session token and store in Redis"""
     session_token = hashlib.sha256(f"{email}{time.time()}{os.urandom(16)}".encode()).hexdigest()
-    session_data = {
-        'email': email,
-        'created_at': time.time()
-    }
     if redis_client:
-        redis_client.setex(session_token, 86400, json.dumps(session_data))
+        # Value is just the email; Redis TTL handles expiry
+        redis_client.setex(session_token, SESSION_TTL, email)
     else:
-        active_sessions[session_token] = session_data
+        with _sessions_lock:
+            active_sessions[session_token] = {'email': email, 'created_at': time.time()}
     return session_token
 
 def verify_session(session_token: Optional[str]) -> Optional[str]:
@@ -155,23 +418,21 @@ def verify_session(session_token: Optional[str]) -> Optional[str]:
         return None
 
     if redis_client:
-        data = redis_client.get(session_token)
-        if not data:
-            return None
-        try:
-            session = json.loads(data)
-            if time.time() - session['created_at'] > 86400:
-                redis_client.delete(session_token)
+        email = redis_client.get(session_token)
+        if email and email.startswith("{"):
+            # JSON session written before the plain-email format; expires within 24h
+            try:
+                return json.loads(email)['email']
+            except (ValueError, KeyError):
                 return None
-            return session['email']
-        except:
-            return None
+        return email
     else:
-        if session_token not in active_sessions:
+        session = active_sessions.get(session_token)
+        if session is None:
             return None
-        session = active_sessions[session_token]
-        if time.time() - session['created_at'] > 86400:
-            del active_sessions[session_token]
+        if time.time() - session['created_at'] > SESSION_TTL:
+            with _sessions_lock:
+                active_sessions.pop(session_token, None)
             return None
         return session['email']
 
@@ -211,6 +472,7 @@ class SessionStartRequest(BaseModel):
 
 class ReportRequest(BaseModel):
     transcript: str
+    language: str = "English"
 
 # --- AUTH ENDPOINTS ---
 @app.get("/", response_class=HTMLResponse)
@@ -229,7 +491,9 @@ async def login_page(request: Request):
 @app.post("/api/login")
 async def login(request: LoginRequest, response: Response):
     """Handle login"""
-    if verify_user(request.email, request.password):
+    # bcrypt takes ~250 ms; inline it would stall every other request and SSE stream
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(executor, verify_user, request.email, request.password):
         session_token = create_session(request.email)
         response.set_cookie(
             key="session_token",
@@ -248,7 +512,8 @@ async def signup(request: SignupRequest):
     if user_exists(request.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    if create_user(request.email, request.password, request.full_name):
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(executor, create_user, request.email, request.password, request.full_name):
         return {"success": True, "message": "Account created successfully"}
     raise HTTPException(status_code=500, detail="Failed to create account")
 
@@ -258,8 +523,9 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get('session_token')
     if redis_client and session_token:
         redis_client.delete(session_token)
-    elif not redis_client and session_token in active_sessions:
-        del active_sessions[session_token]
+    elif not redis_client and session_token:
+        with _sessions_lock:
+            active_sessions.pop(session_token, None)
     response.delete_cookie("session_token")
     return {"success": True, "message": "Logged out"}
 
@@ -275,7 +541,13 @@ MAX_TOKENS_REPORT = 2000
 MAX_TOTAL_TOKENS = 10000
 
 # --- UNLIMITED MEMORY: Shrink Old Messages ---
-def fit_to_token_limit(messages: List[Dict], system_prompt: str) -> List[Dict]:
+def build_chat_messages(history: List[HistoryMessage], system_prompt: str) -> List[Dict]:
+    """Validate role alternation and fit history to the token budget in one pass.
+
+    Walks from the newest message backwards and stops as soon as the budget
+    is spent, so very long histories cost O(budget) rather than O(N).
+    """
+    # count_tokens is memoized, so a persona reused across turns is only encoded once
     system_tokens = count_tokens(system_prompt)
     available = MAX_TOTAL_TOKENS - MAX_TOKENS_CHAT - system_tokens - 100
 
@@ -283,73 +555,207 @@ def fit_to_token_limit(messages: List[Dict], system_prompt: str) -> List[Dict]:
         raise HTTPException(500, "System prompt too long")
 
     total = 0
-    kept = []
+    kept = deque()
+    next_role = None  # role of the newer message already kept
+
+    for m in reversed(history):
+        content = m.content.strip() if m.content else ""
+        if not content:
+            continue
+        if next_role is None:
+            if m.role != "user":
+                raise HTTPException(400, "Therapist must speak last")
+        elif m.role == next_role:
+            raise HTTPException(400, "Wait for patient reply")
+        next_role = m.role
 
-    for msg in reversed(messages):
-        msg_tokens = count_tokens(msg["content"])
+        msg_tokens = count_tokens(content)
         if total + msg_tokens > available:
             max_chars = int(available * 3.5)
             if max_chars > 50:
-                msg["content"] = msg["content"][:max_chars] + "..."
-                msg_tokens = count_tokens(msg["content"])
+                content = content[:max_chars] + "..."
+                msg_tokens = count_tokens(content)
             else:
                 break
-        kept.append(msg)
+        kept.appendleft({"role": m.role, "content": content})
         total += msg_tokens
         if total > available:
             break
 
-    return list(reversed(kept))
+    if not kept:
+        raise HTTPException(400, "Empty history")
+    return list(kept)
 
 # --- Bedrock Call ---
-def _invoke_bedrock_sync(system_prompt: str, messages: List[Dict], max_tokens: int) -> str:
-    try:
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": messages,
-            "temperature": 0.8,
-            "top_p": 0.9
-        })
-
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=MODEL_ID,
-            contentType="application/json",
-            accept="application/json"
-        )
-
-        result = json.loads(response['body'].read().decode('utf-8'))
-        content = result.get("content", [])
-        if content and content[0].get("type") == "text":
-            return content[0]["text"]
-        raise Exception("No text in response")
+def _sign_bedrock_request(url: str, body: bytes, accept: str = "application/json") -> Dict[str, str]:
+    request = AWSRequest(
+        method="POST",
+        url=url,
+        data=body,
+        headers={"Content-Type": "application/json", "Accept": accept}
+    )
+    # get_frozen_credentials() refreshes role/SSO credentials when they are close to expiry
+    SigV4Auth(bedrock_credentials.get_frozen_credentials(), "bedrock", AWS_REGION).add_auth(request)
+    return dict(request.headers)
+
+def _bedrock_body(system_prompt: str, messages: List[Dict], max_tokens: int) -> bytes:
+    return fast_dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "system": system_prompt,
+        "messages": messages,
+        "temperature": 0.8,
+        "top_p": 0.9
+    })
+
+async def _send_bedrock(url: str, body: bytes, stream: bool = False) -> httpx.Response:
+    """POST a signed request to Bedrock with retries; raises HTTPException on failure"""
+    if not bedrock_client:
+        raise HTTPException(500, "Bedrock not ready")
 
-    except ClientError as e:
-        code = e.response['Error']['Code']
-        if code == 'ThrottlingException':
+    accept = "application/vnd.amazon.eventstream" if stream else "application/json"
+    for attempt in range(BEDROCK_MAX_ATTEMPTS):
+        last_attempt = attempt == BEDROCK_MAX_ATTEMPTS - 1
+        try:
+            request = bedrock_client.build_request(
+                "POST", url, content=body, headers=_sign_bedrock_request(url, body, accept)
+            )
+            response = await bedrock_client.send(request, stream=stream)
+        except httpx.HTTPError as e:
+            if last_attempt:
+                raise HTTPException(500, f"Call failed: {e}")
+            await asyncio.sleep(2 ** attempt)
+            continue
+
+        if response.status_code == 200:
+            return response
+
+        if stream:
+            await response.aread()
+            await response.aclose()
+        code = response.headers.get("x-amzn-ErrorType", str(response.status_code)).split(":")[0]
+        if (response.status_code == 429 or response.status_code >= 500) and not last_attempt:
+            await asyncio.sleep(2 ** attempt)
+            continue
+        if response.status_code == 429 or code == 'ThrottlingException':
             raise HTTPException(429, "Rate limit. Wait 10s.")
         raise HTTPException(500, f"Bedrock error: {code}")
-    except Exception as e:
+
+# Separate concurrency lanes so long report calls never queue ahead of /chat
+BEDROCK_LANES = {
+    "chat": asyncio.Semaphore(int(os.getenv("BEDROCK_CHAT_CONCURRENCY", "64"))),
+    "backstory": asyncio.Semaphore(int(os.getenv("BEDROCK_BACKSTORY_CONCURRENCY", "16"))),
+    "report": asyncio.Semaphore(int(os.getenv("BEDROCK_REPORT_CONCURRENCY", "8"))),
+}
+
+async def _invoke_bedrock_claude(system_prompt: str, messages: List[Dict], max_tokens: int, lane: str = "chat") -> str:
+    async with BEDROCK_LANES[lane]:
+        response = await _send_bedrock(BEDROCK_INVOKE_URL, _bedrock_body(system_prompt, messages, max_tokens))
+    try:
+        content = fast_loads(response.content).get("content", [])
+    except ValueError as e:
         raise HTTPException(500, f"Call failed: {e}")
+    if content and content[0].get("type") == "text":
+        return content[0]["text"]
+    raise HTTPException(500, "Call failed: No text in response")
+
+async def _invoke_bedrock_stream(system_prompt: str, messages: List[Dict], max_tokens: int, lane: str = "chat") -> AsyncIterator[Dict]:
+    """Open an InvokeModelWithResponseStream call and return its decoded JSON events.
+
+    The request is sent before the first event is requested, so connection,
+    auth and throttling errors still surface as HTTPException. The lane slot
+    is held until the stream is exhausted or closed.
+    """
+    semaphore = BEDROCK_LANES[lane]
+    await semaphore.acquire()
+    try:
+        response = await _send_bedrock(
+            BEDROCK_STREAM_URL, _bedrock_body(system_prompt, messages, max_tokens), stream=True
+        )
+    except BaseException:
+        semaphore.release()
+        raise
 
-async def _invoke_bedrock_claude(system_prompt: str, messages: List[Dict], max_tokens: int) -> str:
-    if not bedrock_client:
-        raise HTTPException(500, "Bedrock not ready")
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, _invoke_bedrock_sync, system_prompt, messages, max_tokens)
+    async def events() -> AsyncIterator[Dict]:
+        buffer = EventStreamBuffer()
+        try:
+            async for chunk in response.aiter_bytes():
+                buffer.add_data(chunk)
+                for message in buffer:
+                    payload = fast_loads(message.payload)
+                    if message.headers.get(":message-type") == "exception":
+                        raise Exception(payload.get("message", "Bedrock stream error"))
+                    yield fast_loads(base64.b64decode(payload["bytes"]))
+        finally:
+            await response.aclose()
+            semaphore.release()
+
+    return events()
+
+# Open the pooled TLS connection up front so the first /chat calls skip the handshake
+# One unsigned GET to the endpoint is enough: it isn't an InvokeModel call, so it
+# is never billed, and over HTTP/2 every later call multiplexes on the connection it opens
+BEDROCK_PREWARM = os.getenv("BEDROCK_PREWARM", "1") != "0"
+
+async def _prewarm_bedrock():
+    try:
+        await bedrock_client.get(str(httpx.URL(BEDROCK_INVOKE_URL).join("/")))  # any status will do
+    except httpx.HTTPError as e:
+        logger.warning("Bedrock prewarm failed: %s", e)
+
+@app.on_event("startup")
+async def prewarm_bedrock():
+    if bedrock_client and BEDROCK_PREWARM:
+        asyncio.create_task(_prewarm_bedrock())
+
+@app.on_event("shutdown")
+async def close_bedrock():
+    if bedrock_client:
+        await bedrock_client.aclose()
 
 # --- Backstory ---
+BACKSTORY_CACHE_TTL = 604800  # 7 days
+BACKSTORY_VARIANTS = 10       # cached variants per input tuple, keeps sessions varied
+
+def _backstory_key(diseases: str, age: int, gender: str, profession: str) -> str:
+    digest = hashlib.sha256(f"{age}|{gender}|{profession}|{diseases}".encode()).hexdigest()
+    return f"backstory:{digest}"
+
 async def _generate_unique_backstory(diseases: str, age: int, gender: str, profession: str) -> str:
+    key = _backstory_key(diseases, age, gender, profession)
+    if redis_client:
+        try:
+            # Only serve from cache once the variant pool is full
+            if redis_client.llen(key) >= BACKSTORY_VARIANTS:
+                cached = redis_client.lindex(key, random.randrange(BACKSTORY_VARIANTS))
+                if cached:
+                    return cached
+        except redis.RedisError as e:
+            print(f"Backstory cache read failed: {e}")
+
     prompt = "10-sentence trauma backstory. Be specific."
     msg = f"{age}yo {gender} {profession} with {diseases}. What happened?"
     try:
-        return await _invoke_bedrock_claude(prompt, [{"role": "user", "content": msg}], MAX_TOKENS_BACKSTORY)
+        backstory = await _invoke_bedrock_claude(
+            prompt, [{"role": "user", "content": msg}], MAX_TOKENS_BACKSTORY, lane="backstory"
+        )
     except:
         return f"Trauma from {diseases.split(',')[0].strip()}."
 
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.lpush(key, backstory)
+            pipe.ltrim(key, 0, BACKSTORY_VARIANTS - 1)
+            pipe.expire(key, BACKSTORY_CACHE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Backstory cache write failed: {e}")
+    return backstory
+
 # --- Persona ---
+# Backstories come from a small cached pool, so identical argument tuples recur often
+@lru_cache(maxsize=1024)
 def create_base_persona(diseases: str, age: int, ethnicity: str, working_domain: str, gender: str, backstory: str) -> str:
     return f"""You are Alex, {age}-year-old {gender} {ethnicity} {working_domain}.
 Conditions: {diseases}
@@ -365,23 +771,49 @@ RULES:
 You reply with spoken words only."""
 
 # --- Report ---
-def create_report_prompt(transcript: str) -> str:
-    t = transcript[:3000] + ("..." if len(transcript) > 3000 else "")
-    return f"""Analyze session:
+# Compiled once; filled per request with Template.substitute
+REPORT_PROMPT_TEMPLATE = Template("""You are an expert clinical supervisor. Generate a complete Clinical Supervision Competency Summary Report for the supervisee using the 15 competencies below. Rate each 1-5 (1=major issues, 2=emerging/inconsistent, 3=meets expectations, 4=strong/independent, 5=advanced/model). Base every rating on concrete behavioral evidence from the provided transcript/observations. Calculate average (round to 1 decimal) and overall level (1.0-1.9 Remediation, 2.0-2.9 Emerging, 3.0-3.9 Competent, 4.0-4.9 Strong, 5.0 Advanced).\n\nCOMPETENCIES & ANCHORS (short):\n1. Rapport & Alliance: warm greeting, attunement, trust (1=flat/distant ↔ 5=deep bond)\n2. Empathic Communication: accurate reflection, validates emotion (1=misses/dismisses ↔ 5=deep insight)\n3. Boundaries & Ethics: time, confidentiality, no dual rel. (1=breaches ↔ 5=models ethics)\n4. Session Structure & Flow: agenda, pacing, closure (1=no structure ↔ 5=strategic flow)\n5. Assessment & Questioning: balanced open/closed, thorough (1=superficial/leading ↔ 5=seamless)\n6. Case Conceptualization: links T-E-B, theory-based (1=none ↔ 5=elegant formulation)\n7. Goal-Setting & Treatment Planning: collaborative, measurable (1=vague ↔ 5=client-owned)\n8. Intervention Skills: correct EBP technique, tailored (1=wrong ↔ 5=creative mastery)\n9. Managing Resistance & Affect: names emotion, de-escalates (1=avoids ↔ 5=resolves ruptures)\n10. Cultural Sensitivity: inclusive, adapts (1=stereotypes ↔ 5=deep humility)\n11. Ethical Practice: consent, risk screening (1=lapses ↔ 5=prevents risk)\n12. Clinical Judgment: prioritizes, scope (1=unsafe ↔ 5=intuitive+theory)\n13. Documentation Quality: SOAP/DAP, objective (1=missing ↔ 5=model notes)\n14. Reflective Practice: self-aware, uses feedback (1=defensive ↔ 5=proactive growth)\n15. Professionalism: punctual, prepared (1=late/unprepared ↔ 5=role-model)\n\nREPORT SECTIONS (complete ALL):\n1. Overall Competency Summary: list 15 ratings, average, overall level\n2. Strengths Demonstrated: ≥4 specific examples (score 4-5), format [Competency]: \"quote/paraphrase + behavior\"\n3. Areas for Development: ≥3 specific gaps (score 1-3), format [Competency]: gap + how to improve\n4. Evidence / Supervisor Observations: concrete examples for these 5 areas (quote/paraphrase + context):\n   - Therapeutic Attunement\n   - Therapeutic Skills\n   - Professional Conduct\n   - Clinical Formulation\n   - Risk & Ethics\n5. Training Goals (2-3 SMART goals for lowest scores):\n   Goal | Target Behavior | Timeline | Measure of Progress\n6. Action Plan:\n   - Practice/assignments (2-3)\n   - Required supervision focus (2-3)\n   - Resources (2-4 specific readings/videos/shadowing)\n\nUse professional, evidence-based, developmental language. Be specific, never vague. Output ONLY the sections above with clear headers. Language: $report_language\n\nTRANSCRIPT/OBSERVATIONS:\n$patient_transcript""")
 
-{t}
+# Static prompt cost is fixed, so count it once at import rather than per report
+REPORT_PROMPT_TOKENS = count_tokens(REPORT_PROMPT_TEMPLATE.substitute(report_language="", patient_transcript=""))
+REPORT_TRANSCRIPT_BUDGET = MAX_TOTAL_TOKENS - MAX_TOKENS_REPORT - REPORT_PROMPT_TOKENS - 100
 
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text to at most `budget` tokens, appending '...' when truncated"""
+    if not encoder:
+        max_chars = int(budget * 3.5)
+        return text if len(text) <= max_chars else text[:max_chars] + "..."
+    tokens = encoder.encode(text)
+    if len(tokens) <= budget:
+        return text
+    return encoder.decode(tokens[:budget]) + "..."
 
-  "You are an expert clinical supervisor. Generate a complete Clinical Supervision Competency Summary Report for the supervisee using the 15 competencies below. Rate each 1-5 (1=major issues, 2=emerging/inconsistent, 3=meets expectations, 4=strong/independent, 5=advanced/model). Base every rating on concrete behavioral evidence from the provided transcript/observations. Calculate average (round to 1 decimal) and overall level (1.0-1.9 Remediation, 2.0-2.9 Emerging, 3.0-3.9 Competent, 4.0-4.9 Strong, 5.0 Advanced).\n\nCOMPETENCIES & ANCHORS (short):\n1. Rapport & Alliance: warm greeting, attunement, trust (1=flat/distant ↔ 5=deep bond)\n2. Empathic Communication: accurate reflection, validates emotion (1=misses/dismisses ↔ 5=deep insight)\n3. Boundaries & Ethics: time, confidentiality, no dual rel. (1=breaches ↔ 5=models ethics)\n4. Session Structure & Flow: agenda, pacing, closure (1=no structure ↔ 5=strategic flow)\n5. Assessment & Questioning: balanced open/closed, thorough (1=superficial/leading ↔ 5=seamless)\n6. Case Conceptualization: links T-E-B, theory-based (1=none ↔ 5=elegant formulation)\n7. Goal-Setting & Treatment Planning: collaborative, measurable (1=vague ↔ 5=client-owned)\n8. Intervention Skills: correct EBP technique, tailored (1=wrong ↔ 5=creative mastery)\n9. Managing Resistance & Affect: names emotion, de-escalates (1=avoids ↔ 5=resolves ruptures)\n10. Cultural Sensitivity: inclusive, adapts (1=stereotypes ↔ 5=deep humility)\n11. Ethical Practice: consent, risk screening (1=lapses ↔ 5=prevents risk)\n12. Clinical Judgment: prioritizes, scope (1=unsafe ↔ 5=intuitive+theory)\n13. Documentation Quality: SOAP/DAP, objective (1=missing ↔ 5=model notes)\n14. Reflective Practice: self-aware, uses feedback (1=defensive ↔ 5=proactive growth)\n15. Professionalism: punctual, prepared (1=late/unprepared ↔ 5=role-model)\n\nREPORT SECTIONS (complete ALL):\n1. Overall Competency Summary: list 15 ratings, average, overall level\n2. Strengths Demonstrated: ≥4 specific examples (score 4-5), format [Competency]: \"quote/paraphrase + behavior\"\n3. Areas for Development: ≥3 specific gaps (score 1-3), format [Competency]: gap + how to improve\n4. Evidence / Supervisor Observations: concrete examples for these 5 areas (quote/paraphrase + context):\n   - Therapeutic Attunement\n   - Therapeutic Skills\n   - Professional Conduct\n   - Clinical Formulation\n   - Risk & Ethics\n5. Training Goals (2-3 SMART goals for lowest scores):\n   Goal | Target Behavior | Timeline | Measure of Progress\n6. Action Plan:\n   - Practice/assignments (2-3)\n   - Required supervision focus (2-3)\n   - Resources (2-4 specific readings/videos/shadowing)\n\nUse professional, evidence-based, developmental language. Be specific, never vague. Output ONLY the sections above with clear headers. Language: {report_language}\n\nTRANSCRIPT/OBSERVATIONS:\n{patient_transcript}"
-"""
+def create_report_prompt(transcript: str, language: str = "English") -> str:
+    t = truncate_to_tokens(transcript, REPORT_TRANSCRIPT_BUDGET)
+    return REPORT_PROMPT_TEMPLATE.substitute(report_language=language, patient_transcript=t)
 
 # --- PROTECTED ENDPOINTS ---
+VIDEO_PATH = "templates/M-30India.mp4"
+VIDEO_CACHE_CONTROL = "private, max-age=86400"
+
+def _file_etag(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return '"' + hashlib.md5(f"{stat.st_mtime}{stat.st_size}".encode()).hexdigest() + '"'
+
+# Computed once; the video never changes while the process is running
+VIDEO_ETAG = _file_etag(VIDEO_PATH)
+
 @app.get("/M-30India.mp4")
-async def get_video(current_user: str = Depends(get_current_user)):
-    path = "templates/M-30India.mp4"
-    if not os.path.exists(path):
+async def get_video(request: Request, current_user: str = Depends(get_current_user)):
+    if not VIDEO_ETAG:
         raise HTTPException(404, "Video not found")
-    return FileResponse(path, media_type="video/mp4")
+    headers = {"ETag": VIDEO_ETAG, "Cache-Control": VIDEO_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == VIDEO_ETAG:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(VIDEO_PATH, media_type="video/mp4", headers=headers)
 
 @app.post("/start_session")
 async def start_session(request: SessionStartRequest, current_user: str = Depends(get_current_user)):
@@ -400,37 +832,37 @@ async def start_session(request: SessionStartRequest, current_user: str = Depend
 async def chat(request: ChatRequest, current_user: str = Depends(get_current_user)):
     start = time.time()
     system_prompt = request.persona_prompt
+    messages = build_chat_messages(request.history, system_prompt)
 
-    messages = [
-        {"role": m.role, "content": m.content.strip()}
-        for m in request.history
-        if m.content and m.content.strip()
-    ]
-
-    if not messages:
-        raise HTTPException(400, "Empty history")
-
-    for i in range(1, len(messages)):
-        if messages[i]["role"] == messages[i-1]["role"]:
-            raise HTTPException(400, "Wait for patient reply")
-
-    if messages[-1]["role"] != "user":
-        raise HTTPException(400, "Therapist must speak last")
+    events = await _invoke_bedrock_stream(system_prompt, messages, MAX_TOKENS_CHAT)
 
-    messages = fit_to_token_limit(messages, system_prompt)
-
-    reply = await _invoke_bedrock_claude(system_prompt, messages, MAX_TOKENS_CHAT)
-    print(f"Reply: {time.time()-start:.2f}s | Context: {len(messages)} msgs, ~{count_tokens(json.dumps(messages))} tokens")
-    return {"reply": reply}
+    async def sse():
+        try:
+            async for event in events:
+                if event.get("type") == "content_block_delta":
+                    text = event.get("delta", {}).get("text", "")
+                    if text:
+                        yield f"data: {fast_dumps({'delta': text}).decode()}\n\n"
+            yield f"data: {fast_dumps({'done': True}).decode()}\n\n"
+        except Exception as e:
+            print(f"Chat stream failed: {e}")
+            yield f"data: {fast_dumps({'error': 'Stream interrupted'}).decode()}\n\n"
+        if DEBUG:
+            print(f"Reply: {time.time()-start:.2f}s | Context: {len(messages)} msgs, ~{count_tokens(fast_dumps(messages).decode())} tokens")
+        else:
+            print(f"Reply: {time.time()-start:.2f}s | Context: {len(messages)} msgs")
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
 
 @app.post("/generate_report")
 async def generate_report(request: ReportRequest, current_user: str = Depends(get_current_user)):
     start = time.time()
-    prompt = create_report_prompt(request.transcript)
+    prompt = create_report_prompt(request.transcript, request.language)
     report = await _invoke_bedrock_claude(
         "Concise therapy evaluator.",
         [{"role": "user", "content": prompt}],
-        MAX_TOKENS_REPORT
+        MAX_TOKENS_REPORT,
+        lane="report"
     )
     print(f"Report: {time.time()-start:.2f}s")
     return {"report": report}
@@ -441,29 +873,27 @@ async def login_list(request: Request):
     return templates.TemplateResponse("loginlist.html", {"request": request})
 
 @app.get("/api/users")
-async def get_users():
-    """API endpoint to fetch all users"""
-    if not os.path.exists(USER_DB_FILE):
-        return {"users": []}
+async def get_users(offset: int = 0, limit: Optional[int] = None):
+    """API endpoint to fetch users, newest first (optionally paginated)"""
+    users = [{
+        'email': row['email'],
+        'full_name': row['full_name'],
+        'created_at': row['created_at'],
+        'password_hash': row['password_hint']  # Show partial hash
+    } for row in list_users(offset, limit, USER_LIST_FIELDS)]
 
-    users = []
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            users.append({
-                'email': row['email'],
-                'full_name': row['full_name'],
-                'created_at': row['created_at'],
-                'password_hash': row['password_hash'][:10] + '...'  # Show partial hash
-            })
-
-    return {"users": users, "total": len(users)}
+    return {"users": users, "total": count_users()}
 
 @app.get("/api/download_users_csv")
 async def download_users_csv():
-    """Download the complete users.csv file"""
-    if not os.path.exists(USER_DB_FILE):
+    """Download the users.csv snapshot (refreshed from Redis when older than 60s)"""
+    if not _USER_DB_READY:
         raise HTTPException(404, "User database not found")
+    if redis_client:
+        snapshot_at = redis_client.get(USER_SNAPSHOT_KEY)
+        if not snapshot_at or time.time() - float(snapshot_at) > USER_DUMP_INTERVAL:
+            # Serve the current file now; the next click gets the fresh one
+            asyncio.create_task(refresh_users_snapshot())
     return FileResponse(
         USER_DB_FILE,
         media_type="text/csv",
@@ -473,7 +903,15 @@ async def download_users_csv():
 # --- DELETE USER ---
 def delete_user(email: str) -> bool:
     """Delete a user by email. Returns True if deleted."""
-    if not os.path.exists(USER_DB_FILE):
+    if redis_client:
+        pipe = redis_client.pipeline()
+        pipe.delete(_user_key(email))
+        pipe.zrem(USER_INDEX_KEY, email)
+        deleted, _ = pipe.execute()
+        return bool(deleted)
+
+    _append_user_rows(_take_pending_users())
+    if not _USER_DB_READY:
         return False
 
     users = []
@@ -488,10 +926,7 @@ def delete_user(email: str) -> bool:
             users.append(row)
 
     if deleted:
-        with open(USER_DB_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['email', 'password_hash', 'full_name', 'created_at'])
-            writer.writeheader()
-            writer.writerows(users)
+        _write_users_csv(users)
 
     return deleted
 
@@ -1,66 +1,173 @@
 import os
 import json
-import boto3
+import aioboto3
 import time
 import asyncio
 import csv
+import io
+import sqlite3
 import hashlib
+import random
+import re
+import secrets
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
 from datetime import datetime, timedelta
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from fastapi import FastAPI, HTTPException, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse, JSONResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from functools import lru_cache
+from bisect import bisect_right
+from itertools import accumulate, chain
+from collections import OrderedDict, deque
+import bcrypt
 import redis
+from cachetools import TTLCache
+
+# --- LOGGING (request path only enqueues; a listener thread formats and writes) ---
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_listener.start()
 
 # --- TOKEN COUNTER ---
 try:
     import tiktoken
     encoder = tiktoken.encoding_for_model("gpt-4")
 except:
-    print("tiktoken not found. Install: pip install tiktoken")
+    logger.warning("tiktoken not found. Install: pip install tiktoken")
     encoder = None
 
 def count_tokens(text: str) -> int:
     if not encoder:
         return len(text.split()) * 1.3
     try:
-        return len(encoder.encode(text))
+        # encode_ordinary skips the special-token scan; only the length is used
+        return len(encoder.encode_ordinary(text))
     except:
         return len(text.split()) * 1.3
 
+def _encode_counts(texts: List[str]) -> List[int]:
+    """Token counts for many strings in one tiktoken call (parallel BPE in Rust)"""
+    if not encoder:
+        return [len(text.split()) * 1.3 for text in texts]
+    try:
+        return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts, num_threads=4)]
+    except:
+        return [count_tokens(text) for text in texts]
+
+# Per-message counts: each turn resends the whole history, but only the
+# newest messages are unseen. Only touched from the event loop thread.
+TOKEN_CACHE_SIZE = 16384
+_token_counts: "OrderedDict[str, int]" = OrderedDict()
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Cached token counts; misses are encoded together in one batch"""
+    misses = [text for text in dict.fromkeys(texts) if text not in _token_counts]
+    for text, n in zip(misses, _encode_counts(misses) if misses else []):
+        _token_counts[text] = n
+    counts = []
+    for text in texts:
+        _token_counts.move_to_end(text)
+        counts.append(_token_counts[text])
+    while len(_token_counts) > TOKEN_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return counts
+
+@lru_cache(maxsize=256)
+def count_system_tokens(system_prompt: str) -> int:
+    # The persona is identical on every turn of a session
+    return count_tokens(system_prompt)
+
+# --- FAST JSON ---
+try:
+    import orjson
+    fast_dumps = orjson.dumps  # returns bytes
+    fast_loads = orjson.loads  # accepts bytes or str
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    logger.warning("orjson not found. Install: pip install orjson")
+    DefaultResponse = JSONResponse
+
+    def fast_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+    fast_loads = json.loads
+
 # --- INITIALIZATION ---
 load_dotenv()
-executor = ThreadPoolExecutor(max_workers=10)
+# bcrypt and CSV work only; Bedrock calls are native coroutines (aioboto3)
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", (os.cpu_count() or 2) * 5))
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+# --- AWS Bedrock (aioboto3, client opened at startup) ---
+# game.py runs the same calls over httpx (HTTP/2, botocore's SigV4 and event-stream
+# decoder). Here aioboto3 is kept for botocore's standard-mode retries and the
+# ClientError codes that _bedrock_http_error maps, not because httpx couldn't do it.
+AWS_REGION = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
+MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+# Bedrock prompt caching (cache_control) is only accepted by newer Claude models
+PROMPT_CACHE_MODELS = ("claude-3-5-haiku", "claude-3-7-sonnet", "claude-sonnet-4", "claude-opus-4")
+PROMPT_CACHING = any(name in MODEL_ID for name in PROMPT_CACHE_MODELS)
+retry_config = Config(
+    retries={'max_attempts': 5, 'mode': 'standard'},
+    max_pool_connections=int(os.getenv("BEDROCK_MAX_CONNECTIONS", "100")),
+    # Idle pooled TLS connections survive NAT/LB idle timeouts between report bursts
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=90
+)
+bedrock_client = None
+_bedrock_stack = AsyncExitStack()
 
-# --- AWS Bedrock ---
-try:
-    AWS_REGION = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
-    if not AWS_REGION:
-        raise Exception("AWS_REGION not set")
-
-    retry_config = Config(
-        retries={'max_attempts': 5, 'mode': 'standard'},
-        max_pool_connections=100,
-        connect_timeout=5,
-        read_timeout=90
-    )
+app = FastAPI(default_response_class=DefaultResponse)
+templates = Jinja2Templates(directory="templates")
 
-    bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=retry_config)
-    MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
-    print(f"Bedrock ready: {AWS_REGION} | Model: {MODEL_ID}")
+@app.on_event("startup")
+async def _use_shared_executor():
+    # asyncio.to_thread / run_in_executor(None, ...) share the same sized pool
+    asyncio.get_running_loop().set_default_executor(executor)
 
-except Exception as e:
-    print(f"Bedrock failed: {e}")
+@app.on_event("startup")
+async def _open_bedrock():
+    global bedrock_client
+    try:
+        if not AWS_REGION:
+            raise Exception("AWS_REGION not set")
+        bedrock_client = await _bedrock_stack.enter_async_context(
+            aioboto3.Session().client('bedrock-runtime', region_name=AWS_REGION, config=retry_config)
+        )
+        logger.info("Bedrock ready: %s | Model: %s", AWS_REGION, MODEL_ID)
+    except Exception as e:
+        logger.error("Bedrock failed: %s", e)
+        bedrock_client = None
+
+@app.on_event("shutdown")
+async def _close_bedrock():
+    global bedrock_client
     bedrock_client = None
+    await _bedrock_stack.aclose()
 
-app = FastAPI()
-templates = Jinja2Templates(directory="templates")
+@app.on_event("shutdown")
+async def _flush_logs():
+    # Drains whatever is still queued before the process exits
+    _log_listener.stop()
 
 # --- CORS: Allow all for now (change to domain in prod) ---
 app.add_middleware(
@@ -70,96 +177,205 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+# --- GZIP: HTML pages and JSON reports compress 5-10x ---
+# MP4s are already compressed; /chat and /generate_report stream, and gzip would hold back chunks
+GZIP_SKIP_PATHS = ("/videos/", "/M-30India.mp4", "/chat", "/generate_report")
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(GZIP_SKIP_PATHS):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024)
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# --- USER DATABASE (CSV) ---
-USER_DB_FILE = "users.csv"
+# --- REDIS (sessions + users) ---
+try:
+    # Health-checked pool: stale sockets are pinged before reuse, timeouts retried once
+    redis_pool = redis.ConnectionPool(
+        host='127.0.0.1',
+        port=6379,
+        db=0,
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_POOL_SIZE", "200")),
+        socket_keepalive=True,
+        socket_timeout=2,
+        health_check_interval=30,
+        retry_on_timeout=True
+    )
+    redis_client = redis.Redis(connection_pool=redis_pool)
+    redis_client.ping()
+    logger.info("Redis connected for sessions")
+except Exception as e:
+    logger.warning("Redis failed: %s. Falling back to in-memory (NOT FOR PRODUCTION)", e)
+    redis_client = None
+    # Expired tokens are evicted by the cache itself, so a login storm can't grow it forever
+    active_sessions = TTLCache(maxsize=100_000, ttl=86400)
+    _sessions_lock = threading.Lock()
+
+# --- USER DATABASE (SQLite is the source of truth, Redis hashes cache it) ---
+USER_DB_FILE = "users.db"
+LEGACY_USER_CSV = "users.csv"  # imported once into SQLite, then left as a backup
+USER_FIELDS = ['email', 'password_hash', 'full_name', 'created_at']
+USER_DB_LOCK = threading.Lock()  # one shared connection; calls come from executor threads
+user_db = sqlite3.connect(USER_DB_FILE, check_same_thread=False)
+
+def _user_key(email: str) -> str:
+    return f"user:{email}"
 
 def init_user_db():
-    """Initialize users CSV file if it doesn't exist"""
-    if not os.path.exists(USER_DB_FILE):
-        with open(USER_DB_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['email', 'password_hash', 'full_name', 'created_at'])
+    """Create the users table, import the legacy CSV and mirror users into Redis"""
+    with USER_DB_LOCK:
+        user_db.execute("PRAGMA journal_mode=WAL")
+        user_db.execute("PRAGMA synchronous=NORMAL")
+        with user_db:
+            user_db.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "email TEXT PRIMARY KEY, password_hash TEXT NOT NULL, full_name TEXT, created_at TEXT)"
+            )
+            empty = user_db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+            if empty and os.path.exists(LEGACY_USER_CSV):
+                with open(LEGACY_USER_CSV, 'r', newline='') as f:
+                    rows = [tuple(row.get(k) or '' for k in USER_FIELDS) for row in csv.DictReader(f)]
+                user_db.executemany("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)", rows)
+                logger.info("Imported %d users from %s into %s", len(rows), LEGACY_USER_CSV, USER_DB_FILE)
+        rows = user_db.execute("SELECT email, password_hash, full_name, created_at FROM users").fetchall()
+
+    if not redis_client:
+        return
+
+    pipe = redis_client.pipeline()
+    for row in rows:
+        pipe.exists(_user_key(row[0]))
+    missing = [row for row, exists in zip(rows, pipe.execute()) if not exists]
+    for row in missing:
+        pipe.hset(_user_key(row[0]), mapping=dict(zip(USER_FIELDS, row)))
+    pipe.execute()
+    if missing:
+        logger.info("Imported %d users from %s into Redis", len(missing), USER_DB_FILE)
+
+def _db_user(email: str) -> Optional[Dict[str, str]]:
+    with USER_DB_LOCK:
+        row = user_db.execute(
+            "SELECT email, password_hash, full_name, created_at FROM users WHERE email = ?", (email,)
+        ).fetchone()
+    return {k: v or '' for k, v in zip(USER_FIELDS, row)} if row else None
+
+def users_get(email: str) -> Optional[Dict[str, str]]:
+    """Fetch a user record: Redis cache first, SQLite (the source of truth) on a miss"""
+    if redis_client:
+        user = redis_client.hgetall(_user_key(email))
+        if user:
+            return user
+    user = _db_user(email)
+    if user and redis_client:
+        # Re-warm after a flush/eviction so the next lookup is a cache hit again
+        redis_client.hset(_user_key(email), mapping=user)
+    return user
 
 def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password using bcrypt (C implementation, releases the GIL)"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+
+def _is_bcrypt(password_hash: str) -> bool:
+    return password_hash.startswith("$2")
+
+def _check_password(password: str, password_hash: Optional[str]) -> bool:
+    if not password_hash:
+        return False
+    if _is_bcrypt(password_hash):
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    # Unsalted SHA256 from before bcrypt; upgraded on next successful login
+    return password_hash == hashlib.sha256(password.encode()).hexdigest()
+
+def _update_db_password(email: str, password_hash: str):
+    with USER_DB_LOCK, user_db:
+        user_db.execute("UPDATE users SET password_hash = ? WHERE email = ?", (password_hash, email))
 
 def verify_user(email: str, password: str) -> bool:
-    """Verify user credentials"""
-    if not os.path.exists(USER_DB_FILE):
+    """Verify user credentials (blocking: run in executor)"""
+    user = users_get(email)
+    stored_hash = user.get('password_hash') if user else None
+
+    if not _check_password(password, stored_hash):
         return False
 
-    password_hash = hash_password(password)
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email and row['password_hash'] == password_hash:
-                return True
-    return False
+    if not _is_bcrypt(stored_hash):
+        new_hash = hash_password(password)
+        if redis_client:
+            redis_client.hset(_user_key(email), 'password_hash', new_hash)
+        _update_db_password(email, new_hash)
+    return True
 
 def user_exists(email: str) -> bool:
     """Check if user already exists"""
-    if not os.path.exists(USER_DB_FILE):
-        return False
-
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email:
-                return True
-    return False
+    if redis_client and redis_client.exists(_user_key(email)):
+        return True
+    # A Redis miss proves nothing (flush, eviction); SQLite decides
+    with USER_DB_LOCK:
+        return user_db.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone() is not None
 
 def create_user(email: str, password: str, full_name: str) -> bool:
-    """Create new user"""
-    if user_exists(email):
+    """Create new user (blocking: run in executor)"""
+    password_hash = hash_password(password)
+    created_at = datetime.now().isoformat()
+
+    # SQLite is the source of truth: its primary key decides uniqueness and an
+    # existing row is never overwritten, whatever Redis has (or has lost)
+    with USER_DB_LOCK, user_db:
+        inserted = user_db.execute(
+            "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?)",
+            (email, password_hash, full_name, created_at)
+        ).rowcount
+    if not inserted:
         return False
 
-    password_hash = hash_password(password)
-    with open(USER_DB_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([email, password_hash, full_name, datetime.now().isoformat()])
+    if redis_client:
+        # Redis only caches the row just written
+        redis_client.hset(_user_key(email), mapping={
+            'email': email, 'password_hash': password_hash, 'full_name': full_name, 'created_at': created_at
+        })
     return True
 
 # Initialize DB on startup
 init_user_db()
 
-# --- REDIS SESSION MANAGEMENT ---
-try:
-    redis_client = redis.Redis(host='127.0.0.1', port=6379, db=0, decode_responses=True)
-    redis_client.ping()
-    print("Redis connected for sessions")
-except Exception as e:
-    print(f"Redis failed: {e}. Falling back to in-memory (NOT FOR PRODUCTION)")
-    redis_client = None
-    active_sessions = {}
-
 def create_session(email: str) -> str:
     """Create session token and store in Redis"""
-    session_token = hashlib.sha256(f"{email}{time.time()}{os.urandom(16)}".encode()).hexdigest()
+    session_token = secrets.token_urlsafe(32)
     session_data = {
         'email': email,
         'created_at': time.time()
     }
     if redis_client:
-        redis_client.setex(session_token, 86400, json.dumps(session_data))
+        redis_client.setex(session_token, 86400, fast_dumps(session_data))
     else:
-        active_sessions[session_token] = session_data
+        with _sessions_lock:
+            active_sessions[session_token] = session_data
     return session_token
 
+# One GET per request on purpose: no page reads the profile, and with SQLite as the
+# source of truth a missing Redis user hash doesn't mean the account is gone, so a
+# Lua session+profile lookup would only add a second read nobody uses
 def verify_session(session_token: Optional[str]) -> Optional[str]:
     """Verify session token from Redis or memory"""
     if not session_token:
         return None
 
     if redis_client:
-        data = redis_client.get(session_token)
+        try:
+            data = redis_client.get(session_token)
+        except redis.exceptions.RedisError as e:
+            logger.warning("Session lookup failed: %s", e)
+            return None
         if not data:
             return None
         try:
-            session = json.loads(data)
+            session = fast_loads(data)
             if time.time() - session['created_at'] > 86400:
                 redis_client.delete(session_token)
                 return None
@@ -167,13 +383,10 @@ def verify_session(session_token: Optional[str]) -> Optional[str]:
         except:
             return None
     else:
-        if session_token not in active_sessions:
-            return None
-        session = active_sessions[session_token]
-        if time.time() - session['created_at'] > 86400:
-            del active_sessions[session_token]
-            return None
-        return session['email']
+        # TTLCache expires on access too, so reads take the lock as well
+        with _sessions_lock:
+            session = active_sessions.get(session_token)
+        return session['email'] if session else None
 
 async def get_current_user(request: Request) -> str:
     """Dependency to get current user from session"""
@@ -199,7 +412,8 @@ class HistoryMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     history: List[HistoryMessage]
-    persona_prompt: str
+    persona_prompt: Optional[str] = None
+    session_id: Optional[str] = None  # persona cached by /start_session
 
 class SessionStartRequest(BaseModel):
     age: int
@@ -213,6 +427,12 @@ class ReportRequest(BaseModel):
     transcript: str
     chat_history: Optional[List[Dict[str, str]]] = None
 
+# --- PRE-RENDERED PAGES ---
+# logsign.html and index.html take no per-user context, so render them once
+# instead of on every hit.
+LOGIN_HTML_BYTES = templates.get_template("logsign.html").render().encode()
+APP_HTML_BYTES = templates.get_template("index.html").render().encode()
+
 # --- AUTH ENDPOINTS ---
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -225,12 +445,13 @@ async def root(request: Request):
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     """Serve login/signup page"""
-    return templates.TemplateResponse("logsign.html", {"request": request})
+    return HTMLResponse(content=LOGIN_HTML_BYTES)
 
 @app.post("/api/login")
 async def login(request: LoginRequest, response: Response):
     """Handle login"""
-    if verify_user(request.email, request.password):
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(executor, verify_user, request.email, request.password):
         session_token = create_session(request.email)
         response.set_cookie(
             key="session_token",
@@ -249,7 +470,8 @@ async def signup(request: SignupRequest):
     if user_exists(request.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    if create_user(request.email, request.password, request.full_name):
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(executor, create_user, request.email, request.password, request.full_name):
         return {"success": True, "message": "Account created successfully"}
     raise HTTPException(status_code=500, detail="Failed to create account")
 
@@ -259,25 +481,46 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get('session_token')
     if redis_client and session_token:
         redis_client.delete(session_token)
-    elif not redis_client and session_token in active_sessions:
-        del active_sessions[session_token]
+    elif not redis_client and session_token:
+        with _sessions_lock:
+            active_sessions.pop(session_token, None)
     response.delete_cookie("session_token")
     return {"success": True, "message": "Logged out"}
 
 @app.get("/app", response_class=HTMLResponse)
 async def home(request: Request, current_user: str = Depends(get_current_user)):
     """Main application page (protected)"""
-    return templates.TemplateResponse("index.html", {"request": request, "user_email": current_user})
+    return HTMLResponse(content=APP_HTML_BYTES)
 
 # --- CONSTANTS ---
 MAX_TOKENS_CHAT = 500
 MAX_TOKENS_BACKSTORY = 1000
 MAX_TOKENS_REPORT = 10000
 MAX_TOKENS_IMPROVEMENT = 1000
+MAX_TOKENS_IMPROVEMENT_BATCH = 4000
 MAX_TOTAL_TOKENS = 10000
 
 # --- VIDEO SELECTION HELPER ---
 # --- VIDEO SELECTION HELPER ---
+def _normalize_gender(gender: str) -> str:
+    gender_lower = gender.lower().strip()
+    if gender_lower in ['female', 'f', 'woman']:
+        return "female"
+    # male, m, man; default to male for non-binary or other
+    return "male"
+
+@lru_cache(maxsize=None)
+def _video_for(age: int, gender_key: str) -> str:
+    if age <= 25:
+        age_group = "young"
+    elif age <= 40:
+        age_group = "adult"
+    elif age <= 60:
+        age_group = "middle"
+    else:
+        age_group = "senior"
+    return f"{gender_key}-{age_group}.mp4"
+
 def get_video_filename(age: int, gender: str) -> str:
     """
     Return appropriate video filename based on age and gender
@@ -289,101 +532,139 @@ def get_video_filename(age: int, gender: str) -> str:
     - Senior: 61+
     """
     try:
-        # Determine age group
-        if age <= 25:
-            age_group = "young"
-        elif age <= 40:
-            age_group = "adult"
-        elif age <= 60:
-            age_group = "middle"
-        else:
-            age_group = "senior"
-        
-        # Normalize gender
-        gender_lower = gender.lower().strip()
-        if gender_lower in ['male', 'm', 'man']:
-            gender_key = "male"
-        elif gender_lower in ['female', 'f', 'woman']:
-            gender_key = "female"
-        else:
-            # Default to male-adult for non-binary or other
-            gender_key = "male"
-        
-        filename = f"{gender_key}-{age_group}.mp4"
-        print(f"Video selection - Input: age={age}, gender='{gender}' -> Output: {filename}")
+        # Gender is bucketed before the cache so "Male " and "m" share an entry
+        filename = _video_for(age, _normalize_gender(gender))
+        logger.debug("Video selection - Input: age=%s, gender=%r -> Output: %s", age, gender, filename)
         return filename
         
     except Exception as e:
-        print(f"Error in get_video_filename: {e}")
+        logger.warning("Error in get_video_filename: %s", e)
         return "male-adult.mp4"  # Default fallback
 
 # --- UNLIMITED MEMORY: Shrink Old Messages ---
-def fit_to_token_limit(messages: List[Dict], system_prompt: str) -> List[Dict]:
-    system_tokens = count_tokens(system_prompt)
+def fit_to_token_limit(messages: List[Dict], system_prompt: str, system_tokens: Optional[int] = None) -> List[Dict]:
+    if system_tokens is None:
+        system_tokens = count_system_tokens(system_prompt)
     available = MAX_TOTAL_TOKENS - MAX_TOKENS_CHAT - system_tokens - 100
 
     if available < 500:
         raise HTTPException(500, "System prompt too long")
 
-    total = 0
-    kept = []
+    # Prefix sums from the newest message back; bisect finds how many fit whole
+    token_counts = count_tokens_batch([msg["content"] for msg in messages])
+    newest_first = list(accumulate(reversed(token_counts)))
+    fit = bisect_right(newest_first, available)
+    kept = messages[len(messages) - fit:]
 
-    for msg in reversed(messages):
-        msg_tokens = count_tokens(msg["content"])
-        if total + msg_tokens > available:
-            max_chars = int(available * 3.5)
-            if max_chars > 50:
-                msg["content"] = msg["content"][:max_chars] + "..."
-                msg_tokens = count_tokens(msg["content"])
-            else:
-                break
-        kept.append(msg)
-        total += msg_tokens
-        if total > available:
-            break
+    if fit < len(messages):
+        max_chars = int(available * 3.5)
+        if max_chars > 50:
+            boundary = messages[len(messages) - fit - 1]
+            boundary["content"] = boundary["content"][:max_chars] + "..."
+            kept.insert(0, boundary)
 
-    return list(reversed(kept))
+    return kept
 
 # --- Bedrock Call ---
-def _invoke_bedrock_sync(system_prompt: str, messages: List[Dict], max_tokens: int) -> str:
-    try:
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": messages,
-            "temperature": 0.8,
-            "top_p": 0.9
-        })
+def _cached_prompt(system_prompt: str, messages: List[Dict]):
+    """Mark the persona and the conversation so far as a reusable cache prefix.
 
-        response = bedrock_client.invoke_model(
-            body=body,
+    The breakpoint on the newest message means the next turn's request hits
+    the cache for everything before its own new messages.
+    """
+    system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+    if not messages:
+        return system, messages
+    last = messages[-1]
+    marked = {"role": last["role"], "content": [
+        {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+    ]}
+    return system, messages[:-1] + [marked]
+
+def _bedrock_body(system_prompt: str, messages: List[Dict], max_tokens: int) -> bytes:
+    system = system_prompt
+    if PROMPT_CACHING:
+        system, messages = _cached_prompt(system_prompt, messages)
+    return fast_dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "system": system,
+        "messages": messages,
+        "temperature": 0.8,
+        "top_p": 0.9
+    })
+
+def _bedrock_http_error(e: ClientError) -> HTTPException:
+    code = e.response['Error']['Code']
+    if code == 'ThrottlingException':
+        return HTTPException(429, "Rate limit. Wait 10s.")
+    return HTTPException(500, f"Bedrock error: {code}")
+
+async def _invoke_bedrock_claude(system_prompt: str, messages: List[Dict], max_tokens: int) -> str:
+    if not bedrock_client:
+        raise HTTPException(500, "Bedrock not ready")
+    try:
+        response = await bedrock_client.invoke_model(
+            body=_bedrock_body(system_prompt, messages, max_tokens),
             modelId=MODEL_ID,
             contentType="application/json",
             accept="application/json"
         )
-
-        result = json.loads(response['body'].read().decode('utf-8'))
+        async with response['body'] as stream:
+            result = fast_loads(await stream.read())
         content = result.get("content", [])
         if content and content[0].get("type") == "text":
             return content[0]["text"]
         raise Exception("No text in response")
 
     except ClientError as e:
-        code = e.response['Error']['Code']
-        if code == 'ThrottlingException':
-            raise HTTPException(429, "Rate limit. Wait 10s.")
-        raise HTTPException(500, f"Bedrock error: {code}")
+        raise _bedrock_http_error(e)
     except Exception as e:
         raise HTTPException(500, f"Call failed: {e}")
 
-async def _invoke_bedrock_claude(system_prompt: str, messages: List[Dict], max_tokens: int) -> str:
+async def _invoke_bedrock_stream(system_prompt: str, messages: List[Dict], max_tokens: int):
+    """Open a streaming call; returns an async generator of text deltas.
+
+    The request is sent before returning, so throttling and auth errors
+    still surface as HTTPException instead of mid-stream.
+    """
     if not bedrock_client:
         raise HTTPException(500, "Bedrock not ready")
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, _invoke_bedrock_sync, system_prompt, messages, max_tokens)
+    try:
+        response = await bedrock_client.invoke_model_with_response_stream(
+            body=_bedrock_body(system_prompt, messages, max_tokens),
+            modelId=MODEL_ID,
+            contentType="application/json",
+            accept="application/json"
+        )
+    except ClientError as e:
+        raise _bedrock_http_error(e)
+    except Exception as e:
+        raise HTTPException(500, f"Call failed: {e}")
+
+    async def deltas():
+        async for event in response["body"]:
+            chunk = event.get("chunk")
+            if not chunk:
+                continue
+            data = fast_loads(chunk["bytes"])
+            if data.get("type") == "content_block_delta":
+                text = data.get("delta", {}).get("text")
+                if text:
+                    yield text
+
+    return deltas()
 
 # --- Backstory ---
+BACKSTORY_CACHE_TTL = 604800  # 7 days
+BACKSTORY_SLOTS = 8           # cached variants per input tuple, keeps training sims varied
+# In-process copy in front of Redis (and the only cache without it); keyed per slot so variety survives
+_backstory_local = TTLCache(maxsize=512 * BACKSTORY_SLOTS, ttl=BACKSTORY_CACHE_TTL)
+
+def _backstory_cache_key(diseases: str, age: int, gender: str, profession: str) -> str:
+    digest = hashlib.sha256(f"{diseases}|{age}|{gender}|{profession}".encode()).hexdigest()
+    return f"backstory:{digest}:{random.randrange(BACKSTORY_SLOTS)}"
+
 async def _generate_unique_backstory(diseases: str, age: int, gender: str, profession: str) -> str:
     prompt = """You are a clinical psychologist creating realistic patient backgrounds for therapy training simulations.
 
@@ -393,12 +674,62 @@ Your task:
 - Be specific and humanizing 
 - Do NOT mention diagnosis or symptoms, only life events that preceded them"""
     msg = f"{age}yo {gender} {profession} with {diseases}. What happened?"
+    cache_key = _backstory_cache_key(diseases, age, gender, profession)
+    cached = _backstory_local.get(cache_key)
+    if cached:
+        return cached
+    if redis_client:
+        try:
+            cached = redis_client.get(cache_key)
+            if cached:
+                _backstory_local[cache_key] = cached
+                return cached
+        except redis.RedisError as e:
+            logger.warning("Backstory cache read failed: %s", e)
     try:
-        return await _invoke_bedrock_claude(prompt, [{"role": "user", "content": msg}], MAX_TOKENS_BACKSTORY)
+        backstory = await _invoke_bedrock_claude(prompt, [{"role": "user", "content": msg}], MAX_TOKENS_BACKSTORY)
     except:
         return f"Trauma from {diseases.split(',')[0].strip()}."
+    _backstory_local[cache_key] = backstory
+    if redis_client:
+        try:
+            redis_client.setex(cache_key, BACKSTORY_CACHE_TTL, backstory)
+        except redis.RedisError as e:
+            logger.warning("Backstory cache write failed: %s", e)
+    return backstory
 
 # --- Persona ---
+PERSONA_TTL = 86400  # same lifetime as a login session
+
+def _persona_key(session_id: str) -> str:
+    return f"persona:{session_id}"
+
+def cache_persona(persona: str) -> Optional[str]:
+    """Store the built persona and its token count once; returns the session id"""
+    if not redis_client:
+        return None
+    session_id = secrets.token_urlsafe(16)
+    try:
+        redis_client.setex(
+            _persona_key(session_id), PERSONA_TTL,
+            fast_dumps({"prompt": persona, "tokens": count_system_tokens(persona)})
+        )
+    except redis.RedisError as e:
+        logger.warning("Persona cache write failed: %s", e)
+        return None
+    return session_id
+
+def load_persona(session_id: Optional[str]) -> Optional[Dict]:
+    if not (redis_client and session_id):
+        return None
+    try:
+        data = redis_client.get(_persona_key(session_id))
+    except redis.RedisError as e:
+        logger.warning("Persona cache read failed: %s", e)
+        return None
+    return fast_loads(data) if data else None
+
+@lru_cache(maxsize=512)
 def create_base_persona(diseases: str, age: int, ethnicity: str, working_domain: str, gender: str, backstory: str) -> str:
     return f"""You are Sai, a {age}-year-old {gender} {ethnicity} {working_domain} in therapy.
 
@@ -437,9 +768,13 @@ INCORRECT (has actions - DO NOT DO THIS):
 "nervously Maybe?"
 
 Begin speaking as the patient. DIALOGUE ONLY."""
-def create_report_prompt(transcript: str) -> str:
-    t = transcript[:3000] + ("..." if len(transcript) > 3000 else "")
-    return f"""Prompt: Clinical Supervision Competency Report Generator
+# A character cap on the decoded str, not a byte slice of the body: the JSON body is
+# already parsed to str before the handler runs, and a byte cut could split a character
+REPORT_TRANSCRIPT_CHARS = 3000
+
+# Built once at import; {t} is the only placeholder. str.replace leaves any
+# other braces in the rubric alone, unlike format().
+REPORT_PROMPT_TEMPLATE = """Prompt: Clinical Supervision Competency Report Generator
 
 You are an experienced clinical supervisor tasked with evaluating a supervisee's clinical competency and generating a comprehensive Clinical Supervision Competency Summary Report.
 
@@ -826,127 +1161,30 @@ OUTPUT REQUIREMENTS
 
 ---
 
-FORMATTING GUIDELINES - TAILWIND + DARK THEME COMPATIBLE (PSYCLINIC AI)
-
-YOU MUST USE THESE EXACT TAILWIND CLASSES AND STYLES TO MATCH THE PAGE THEME:
-
-1. MAIN SECTION HEADERS (Section 1–6) — **HIGHLIGHTED WITH GRADIENT BORDER + GLOW**
-   Use:
-   <h1 class="text-2xl md:text-3xl font-bold text-transparent bg-clip-text bg-gradient-to-r from-cyan-400 to-purple-500 mb-6 pb-3 border-b-2 border-gradient-to-r from-cyan-400/50 to-purple-500/50 shadow-lg shadow-cyan-500/20">
-     Section 1: Overall Competency Summary
-   </h1>
-
-2. SUB-HEADERS:
-   Use:
-   <h3 class="text-xl font-semibold text-cyan-300 mt-8 mb-4 flex items-center gap-2">
-     <i class="fas fa-circle text-cyan-400 text-xs"></i> Competency Ratings
-   </h3>
-
-3. COMPETENCY TABLE — **GLASSMORPHIC DARK STYLE**
-   <div class="overflow-x-auto rounded-xl border border-cyan-400/20 bg-gradient-to-b from-white/5 to-white/2 backdrop-blur-sm">
-     <table class="w-full text-sm md:text-base">
-       <thead>
-         <tr class="bg-gradient-to-r from-cyan-900/30 to-purple-900/30">
-           <th class="text-left p-4 font-semibold text-cyan-300">Competency</th>
-           <th class="text-center p-4 w-24 font-semibold text-cyan-300">Rating/5</th>
-         </tr>
-       </thead>
-       <tbody class="divide-y divide-cyan-400/10">
-         <tr class="hover:bg-white/5 transition-colors">
-           <td class="p-4 text-gray-200">1. Rapport & Alliance</td>
-           <td class="p-4 text-center font-bold text-cyan-400">4</td>
-         </tr>
-         [... continue for all 15 ...]
-       </tbody>
-     </table>
-   </div>
-
-4. AVERAGE SCORE & OVERALL LEVEL — **NEON GLOW BOX**
-   <div class="mt-8 p-6 rounded-2xl bg-gradient-to-br from-cyan-900/20 to-purple-900/20 border border-cyan-400/30 backdrop-blur-md shadow-xl shadow-cyan-500/20">
-     <p class="text-lg md:text-xl font-bold text-cyan-300">
-       <i class="fas fa-star mr-2 text-yellow-400"></i>
-       Average Competency Score: <span class="text-2xl text-cyan-100">2.2</span>
-     </p>
-     <p class="text-lg md:text-xl font-bold text-purple-300 mt-2">
-       <i class="fas fa-level-up-alt mr-2"></i>
-       Overall Level: <span class="text-2xl text-purple-100">EMERGING</span>
-     </p>
-   </div>
-
-5. BULLET LISTS — **CONSISTENT GLASS STYLE**
-   <ul class="space-y-3 mt-4">
-     <li class="flex items-start gap-3 p-4 rounded-lg bg-white/5 border border-cyan-400/20 hover:bg-white/10 transition-all">
-       <i class="fas fa-check-circle text-green-400 mt-1"></i>
-       <span class="text-gray-200"><strong class="text-cyan-300">Rapport & Alliance:</strong> Established warm connection immediately by greeting client by name and using open body language. Client appeared relaxed and engaged throughout.</span>
-     </li>
-   </ul>
-
-6. LABELS (Goal:, etc.):
-   <strong class="text-cyan-300">Goal:</strong> <span class="text-gray-200">...</span>
-
-7. HORIZONTAL DIVIDERS:
-   <hr class="my-10 border-t border-gradient-to-r from-transparent via-cyan-400/30 to-transparent">
-
-8. CONSISTENT TYPOGRAPHY:
-   - All text: text-gray-200
-   - Strong labels: text-cyan-300
-   - Ratings: text-cyan-400 font-bold
-   - No white backgrounds, no conflicting colors
-
----
-
-EXAMPLE FORMATTING (Section 1):
-
-<h1 class="text-2xl md:text-3xl font-bold text-transparent bg-clip-text bg-gradient-to-r from-cyan-400 to-purple-500 mb-6 pb-3 border-b-2 border-gradient-to-r from-cyan-400/50 to-purple-500/50 shadow-lg shadow-cyan-500/20">
-  Section 1: Overall Competency Summary
-</h1>
-
-<h3 class="text-xl font-semibold text-cyan-300 mt-8 mb-4 flex items-center gap-2">
-  <i class="fas fa-circle text-cyan-400 text-xs"></i> Competency Ratings
-</h3>
-
-<div class="overflow-x-auto rounded-xl border border-cyan-400/20 bg-gradient-to-b from-white/5 to-white/2 backdrop-blur-sm">
-  <table class="w-full text-sm md:text-base">
-    <thead>
-      <tr class="bg-gradient-to-r from-cyan-900/30 to-purple-900/30">
-        <th class="text-left p-4 font-semibold text-cyan-300">Competency</th>
-        <th class="text-center p-4 w-24 font-semibold text-cyan-300">Rating</th>
-      </tr>
-    </thead>
-    <tbody class="divide-y divide-cyan-400/10">
-      <tr class="hover:bg-white/5 transition-colors">
-        <td class="p-4 text-gray-200">1. Rapport & Alliance</td>
-        <td class="p-4 text-center font-bold text-cyan-400">4</td>
-      </tr>
-      ...
-    </tbody>
-  </table>
-</div>
-
-<div class="mt-8 p-6 rounded-2xl bg-gradient-to-br from-cyan-900/20 to-purple-900/20 border border-cyan-400/30 backdrop-blur-md shadow-xl shadow-cyan-500/20">
-  <p class="text-lg md:text-xl font-bold text-cyan-300">
-    <i class="fas fa-star mr-2 text-yellow-400"></i>
-    Average Competency Score: <span class="text-2xl text-cyan-100">2.2</span>
-  </p>
-  <p class="text-lg md:text-xl font-bold text-purple-300 mt-2">
-    <i class="fas fa-level-up-alt mr-2"></i>
-    Overall Level: <span class="text-2xl text-purple-100">EMERGING</span>
-  </p>
-</div>
-
-<hr class="my-10 border-t border-gradient-to-r from-transparent via-cyan-400/30 to-transparent">
-
----
-
-CRITICAL FIXES:
-- **All section headers use gradient text + glowing border**
-- **No white backgrounds anywhere**
-- **Table uses glassmorphic dark style with cyan/purple gradients**
-- **Average box is neon-glow styled**
-- **All lists use identical glass card style**
-- **All text is text-gray-200, strong labels text-cyan-300**
-- **Icons used for visual hierarchy**
-- **Fully compatible with Psyclinic AI dark theme**
+OUTPUT FORMAT - JSON ONLY
+
+The page renders the report itself. Return ONE JSON object and nothing else (no HTML, no Markdown, no code fences):
+
+{
+  "ratings": [15 integers 1-5, in the competency order above],
+  "strengths": [{"area": "Competency area", "text": "Specific observable behavior with concrete example"}],
+  "development": [{"area": "Competency area", "text": "Specific skill gap with developmental recommendation"}],
+  "evidence": {
+    "therapeutic_attunement": "...",
+    "therapeutic_skills": "...",
+    "professional_conduct": "...",
+    "clinical_formulation": "...",
+    "risk_ethics": "..."
+  },
+  "goals": [{"goal": "...", "target": "...", "timeline": "...", "measure": "..."}],
+  "action_plan": {
+    "practice": ["..."],
+    "supervision_focus": ["..."],
+    "resources": ["..."]
+  }
+}
+
+The average score and overall level are calculated from "ratings" by the application.
 
 ---
 
@@ -971,13 +1209,105 @@ Before submitting the report, verify:
 - Action plan has all 3 subsections completed
 - All ratings are supported by observable behavioral evidence
 - Language is professional, objective, and developmental
-- **FORMATTING: Gradient headers, glass tables, neon boxes, consistent dark theme styling**
+- Output is a single valid JSON object matching the format above
 
 TRANSCRIPT:
 {t}
 
-Generate a complete Clinical Supervision Competency Summary Report following all sections and guidelines above. **USE TAILWIND CLASSES AND DARK THEME STYLES ABOVE — DO NOT USE HTML STYLES.**
+Generate a complete Clinical Supervision Competency Summary Report following all sections and guidelines above. **RETURN ONLY THE JSON OBJECT.**
 """
+
+def create_report_prompt(transcript: str) -> str:
+    # Slicing a str copies only the kept prefix (and nothing when it is short)
+    t = transcript
+    if len(t) > REPORT_TRANSCRIPT_CHARS:
+        t = t[:REPORT_TRANSCRIPT_CHARS] + "..."
+    return REPORT_PROMPT_TEMPLATE.replace("{t}", t, 1)
+
+# --- Report rendering ---
+# The model returns JSON; the static Tailwind scaffold lives in templates/report.html
+# and is compiled once here instead of being re-emitted by the model every time.
+COMPETENCIES = (
+    "Rapport & Alliance", "Empathic Communication", "Boundaries & Ethics",
+    "Session Structure & Flow", "Assessment & Questioning", "Case Conceptualization",
+    "Goal-Setting & Treatment Planning", "Intervention Skills", "Managing Resistance & Affect",
+    "Cultural Sensitivity", "Ethical Practice", "Clinical Judgment",
+    "Documentation Quality", "Reflective Practice", "Professionalism",
+)
+EVIDENCE_AREAS = (
+    ("therapeutic_attunement", "Therapeutic Attunement"),
+    ("therapeutic_skills", "Therapeutic Skills"),
+    ("professional_conduct", "Professional Conduct"),
+    ("clinical_formulation", "Clinical Formulation"),
+    ("risk_ethics", "Risk & Ethics"),
+)
+ACTION_PLAN_AREAS = (
+    ("practice", "Practice / assignment areas"),
+    ("supervision_focus", "Required supervision focus"),
+    ("resources", "Resources recommended (readings, role-plays, shadowing)"),
+)
+REPORT_LEVELS = ((2.0, "Needs Remediation"), (3.0, "Emerging"), (4.0, "Competent"), (5.0, "Strong"))
+
+# auto_reload=False: the compiled template is never re-checked against the file
+report_env = Environment(
+    loader=FileSystemLoader("templates"),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+REPORT_TEMPLATE = report_env.get_template("report.html")
+
+def _parse_report_json(raw: str) -> Optional[Dict]:
+    # Tolerate stray prose or code fences around the object
+    start, end = raw.find("{"), raw.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        data = fast_loads(raw[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _rating(value) -> Optional[int]:
+    try:
+        return min(5, max(1, int(value)))
+    except (TypeError, ValueError):
+        return None
+
+def _entries(value) -> List[Dict]:
+    """Normalize a list of strings or {area, text} dicts"""
+    if not isinstance(value, list):
+        return []
+    return [item if isinstance(item, dict) else {"text": str(item)} for item in value]
+
+def render_report(raw: str) -> str:
+    """Slot the model's JSON into the report scaffold; raw text if it isn't JSON"""
+    data = _parse_report_json(raw)
+    if data is None:
+        return REPORT_TEMPLATE.render(raw=raw)
+
+    ratings = [_rating(v) for v in (data.get("ratings") or [])][:len(COMPETENCIES)]
+    ratings += [None] * (len(COMPETENCIES) - len(ratings))
+    scored = [r for r in ratings if r is not None]
+    average = round(sum(scored) / len(scored), 1) if scored else None
+    level = None
+    if average is not None:
+        level = next((name for bound, name in REPORT_LEVELS if average < bound), "Advanced")
+
+    evidence = data.get("evidence") if isinstance(data.get("evidence"), dict) else {}
+    action_plan = data.get("action_plan") if isinstance(data.get("action_plan"), dict) else {}
+    return REPORT_TEMPLATE.render(
+        rows=list(zip(COMPETENCIES, ratings)),
+        average=average,
+        level=level,
+        strengths=_entries(data.get("strengths")),
+        development=_entries(data.get("development")),
+        evidence=[(label, evidence[key]) for key, label in EVIDENCE_AREAS if evidence.get(key)],
+        goals=[g for g in _entries(data.get("goals")) if "goal" in g],
+        action_plan=[(label, _entries(action_plan.get(key))) for key, label in ACTION_PLAN_AREAS],
+    )
+
 # --- NEW: Improvement Suggestions ---
 def create_improvement_prompt(therapist_msg: str, patient_msg: str, context: str) -> str:
     """Generate improvement suggestions for a specific therapist message"""
@@ -998,32 +1328,100 @@ SUGGESTION: [If NEEDS_IMPROVEMENT, provide a better alternative in 2-3 sentences
 
 Be strict - only mark as GOOD if the response shows excellent therapeutic skills."""
 
+def create_improvement_batch_prompt(turns: List[tuple]) -> str:
+    """Same review as create_improvement_prompt for several exchanges, answered as one JSON array"""
+    exchanges = fast_dumps([
+        {
+            "i": n,
+            "context": context[:300] if context else "Start of conversation",
+            "therapist": therapist_msg,
+            "patient": patient_msg if patient_msg else "No response yet",
+        }
+        for n, (_, therapist_msg, patient_msg, context) in enumerate(turns)
+    ]).decode()
+
+    return f"""You are an expert therapy supervisor. Analyze each of these exchanges independently:
+
+{exchanges}
+
+Respond with ONLY a JSON array, one object per exchange, in this EXACT shape:
+[{{"i": 0, "status": "GOOD or NEEDS_IMPROVEMENT", "analysis": "1 sentence explaining why", "suggestion": "If NEEDS_IMPROVEMENT, a better alternative in 2-3 sentences. If GOOD, 'No changes needed.'"}}]
+
+Be strict - only mark as GOOD if the response shows excellent therapeutic skills."""
+
 # --- VIDEO ENDPOINTS ---
+# Optional hand-off to nginx: the app keeps the auth check, nginx streams the
+# file with sendfile. Example, with VIDEO_ACCEL_PREFIX=/protected-videos/ :
+#   location /protected-videos/ { internal; alias /srv/app/templates/;
+#                                 sendfile on; tcp_nopush on; aio threads; }
+VIDEO_ACCEL_PREFIX = os.getenv("VIDEO_ACCEL_PREFIX")
+
+# Security: Only allow specific video files
+ALLOWED_VIDEOS = frozenset({
+    "male-young.mp4", "male-adult.mp4", "male-middle.mp4", "male-senior.mp4",
+    "female-young.mp4", "female-adult.mp4", "female-middle.mp4", "female-senior.mp4"
+})
+
+# Videos sit behind login, so shared caches must not keep them ("private")
+VIDEO_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _scan_videos(directory: str = "templates") -> Dict[str, os.stat_result]:
+    """Name -> stat for every MP4 shipped in templates/ (one directory walk)"""
+    try:
+        with os.scandir(directory) as entries:
+            return {e.name: e.stat() for e in entries if e.name.endswith(".mp4") and e.is_file()}
+    except OSError as e:
+        logger.warning("Video scan failed: %s", e)
+        return {}
+
+# Videos ship with the app and don't change at runtime; restart to pick up new files
+PRESENT_VIDEOS = _scan_videos()
+
+def _video_stat(filename: str) -> Optional[os.stat_result]:
+    return PRESENT_VIDEOS.get(filename)
+
+def _video_exists(filename: str) -> bool:
+    return filename in PRESENT_VIDEOS
+
+class VideoFileResponse(FileResponse):
+    # Without a zero-copy path the file goes through userspace in chunk_size reads;
+    # 1 MiB instead of 64 KiB cuts the read/send round trips per video ~16x
+    chunk_size = 1024 * 1024
+
+def _video_response(filename: str, request: Request) -> Response:
+    headers = {"Cache-Control": VIDEO_CACHE_CONTROL}
+    if VIDEO_ACCEL_PREFIX:
+        # nginx adds its own ETag / Range handling for the internal location
+        headers["X-Accel-Redirect"] = f"{VIDEO_ACCEL_PREFIX.rstrip('/')}/{filename}"
+        return Response(media_type="video/mp4", headers=headers)
+
+    stat = _video_stat(filename)
+    etag = f'"{stat.st_mtime:.0f}-{stat.st_size}"'
+    headers["ETag"] = etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    # FileResponse answers Range requests itself; the cached stat skips another stat().
+    # Servers with the ASGI pathsend extension (e.g. granian) get the path, not the bytes,
+    # and send the whole file from the kernel
+    return VideoFileResponse(f"templates/{filename}", media_type="video/mp4", headers=headers, stat_result=stat)
+
 @app.get("/videos/{filename}")
-async def get_video_by_name(filename: str, current_user: str = Depends(get_current_user)):
+async def get_video_by_name(filename: str, request: Request, current_user: str = Depends(get_current_user)):
     """Serve video files dynamically based on filename"""
-    # Security: Only allow specific video files
-    allowed_videos = [
-        "male-young.mp4", "male-adult.mp4", "male-middle.mp4", "male-senior.mp4",
-        "female-young.mp4", "female-adult.mp4", "female-middle.mp4", "female-senior.mp4"
-    ]
-    
-    if filename not in allowed_videos:
+    if filename not in ALLOWED_VIDEOS:
         raise HTTPException(404, "Video not found")
     
-    path = f"templates/{filename}"
-    if not os.path.exists(path):
+    if not _video_exists(filename):
         raise HTTPException(404, f"Video file not found: {filename}")
     
-    return FileResponse(path, media_type="video/mp4")
+    return _video_response(filename, request)
 
 # --- LEGACY VIDEO ENDPOINT (for backwards compatibility) ---
 @app.get("/M-30India.mp4")
-async def get_video(current_user: str = Depends(get_current_user)):
-    path = "templates/M-30India.mp4"
-    if not os.path.exists(path):
+async def get_video(request: Request, current_user: str = Depends(get_current_user)):
+    if not _video_exists("M-30India.mp4"):
         raise HTTPException(404, "Video not found")
-    return FileResponse(path, media_type="video/mp4")
+    return _video_response("M-30India.mp4", request)
 
 # --- SESSION ENDPOINTS ---
 @app.post("/start_session")
@@ -1040,31 +1438,32 @@ async def start_session(request: SessionStartRequest, current_user: str = Depend
             request.working_domain, request.gender, backstory
         )
         
+        session_id = cache_persona(persona)
+
         # Get appropriate video filename with validation
         video_filename = get_video_filename(request.age, request.gender)
         
-        # Debug: Print all relevant information
-        print(f"Session Parameters - Age: {request.age}, Gender: {request.gender}")
-        print(f"Generated video filename: {video_filename}")
+        logger.debug("Session Parameters - Age: %s, Gender: %s", request.age, request.gender)
+        logger.debug("Generated video filename: %s", video_filename)
         
         # Check if video file actually exists
-        video_path = f"templates/{video_filename}"
-        if not os.path.exists(video_path):
-            print(f"WARNING: Video file not found: {video_path}")
+        if not _video_exists(video_filename):
+            logger.warning("Video file not found: templates/%s", video_filename)
             # Fallback to default video
             video_filename = "male-adult.mp4"
-            print(f"Using fallback video: {video_filename}")
+            logger.warning("Using fallback video: %s", video_filename)
         
-        print(f"Session ready: {time.time()-start:.2f}s | Video: {video_filename}")
+        logger.info("Session ready: %.2fs | Video: %s", time.time() - start, video_filename)
         
         return {
             "system_prompt": persona,
+            "session_id": session_id,
             "video_filename": video_filename,
             "backstory": backstory  # Optional: for debugging
         }
         
     except Exception as e:
-        print(f"Error in start_session: {str(e)}")
+        logger.error("Error in start_session: %s", e)
         # Provide fallback response
         return {
             "system_prompt": f"You are Sai, a {request.age}-year-old {request.gender} patient.",
@@ -1075,140 +1474,284 @@ async def start_session(request: SessionStartRequest, current_user: str = Depend
 @app.post("/chat")
 async def chat(request: ChatRequest, current_user: str = Depends(get_current_user)):
     start = time.time()
-    system_prompt = request.persona_prompt
-
-    messages = [
-        {"role": m.role, "content": m.content.strip()}
-        for m in request.history
-        if m.content and m.content.strip()
-    ]
+    cached = load_persona(request.session_id)
+    if cached:
+        system_prompt, system_tokens = cached["prompt"], cached["tokens"]
+    elif request.persona_prompt:
+        system_prompt, system_tokens = request.persona_prompt, None
+    else:
+        raise HTTPException(400, "Session expired. Start a new session.")
+
+    # Build and validate in one pass: skip empties, require alternating roles
+    messages = []
+    prev_role = None
+    for m in request.history:
+        content = m.content.strip() if m.content else ""
+        if not content:
+            continue
+        if m.role == prev_role:
+            raise HTTPException(400, "Wait for patient reply")
+        messages.append({"role": m.role, "content": content})
+        prev_role = m.role
 
     if not messages:
         raise HTTPException(400, "Empty history")
 
-    for i in range(1, len(messages)):
-        if messages[i]["role"] == messages[i-1]["role"]:
-            raise HTTPException(400, "Wait for patient reply")
-
-    if messages[-1]["role"] != "user":
+    if prev_role != "user":
         raise HTTPException(400, "Therapist must speak last")
 
-    messages = fit_to_token_limit(messages, system_prompt)
+    messages = fit_to_token_limit(messages, system_prompt, system_tokens)
+
+    deltas = await _invoke_bedrock_stream(system_prompt, messages, MAX_TOKENS_CHAT)
+
+    async def sse():
+        try:
+            async for text in deltas:
+                yield f"data: {fast_dumps({'delta': text}).decode()}\n\n"
+            yield f"data: {fast_dumps({'done': True}).decode()}\n\n"
+        except Exception as e:
+            logger.error("Chat stream failed: %s", e)
+            yield f"data: {fast_dumps({'error': 'Stream interrupted'}).decode()}\n\n"
+        # The token sum is only worth computing when the line is actually emitted
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Reply: %.2fs | Context: %d msgs, ~%d tokens", time.time() - start, len(messages),
+                        sum(count_tokens_batch([m['content'] for m in messages])))
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
+
+# --- Improvements ---
+IMPROVEMENT_SYSTEM_PROMPT = "Expert therapy supervisor providing constructive feedback."
+# Shared across requests so parallel reports together stay under Bedrock TPS limits
+IMPROVEMENT_SEMAPHORE = asyncio.Semaphore(int(os.getenv("IMPROVEMENT_CONCURRENCY", "5")))
+IMPROVEMENT_CACHE_TTL = 604800  # 7 days; regenerated reports replay the same exchanges
+# One call covers this many therapist turns; keeps each reply well inside the output limit
+IMPROVEMENT_BATCH_SIZE = int(os.getenv("IMPROVEMENT_BATCH_SIZE", "10"))
+
+def _improvement_cache_key(therapist_msg: str, patient_response: str, context: str) -> str:
+    digest = hashlib.blake2b(
+        f"{therapist_msg}\0{patient_response}\0{context}".encode(), digest_size=16
+    ).hexdigest()
+    return f"improvement:{digest}"
+
+def _therapist_turns(chat_history: List[Dict[str, str]]):
+    """Yield (index, therapist message, patient reply, context) for each therapist turn"""
+    recent = deque(maxlen=2)  # context window: the previous 2 messages
+    for i, msg in enumerate(chat_history):
+        if msg['role'] == 'user':  # Therapist message
+            # Get patient's response (next message)
+            patient_response = ""
+            if i + 1 < len(chat_history) and chat_history[i + 1]['role'] == 'assistant':
+                patient_response = chat_history[i + 1]['content']
+
+            yield i, msg['content'], patient_response, " | ".join(recent)
+        recent.append(f"{msg['role']}: {msg['content'][:100]}")
+
+def _improvement_fallback(error_msg: str) -> str:
+    fallback = "Unable to generate detailed analysis at this time. "
+    if "rate limit" in error_msg.lower() or "429" in error_msg:
+        fallback += "The AI service is currently busy. This response will be analyzed in the summary above."
+    elif "timeout" in error_msg.lower():
+        fallback += "The analysis request timed out. Your overall performance is covered in the main report."
+    else:
+        fallback += "Please refer to the overall evaluation above for guidance on this exchange."
+    return fallback
+
+async def _invoke_improvement(prompt: str, max_tokens: int, label: str) -> str:
+    """One Bedrock call with retry/backoff; raises once retries are spent"""
+    # Add retry logic with exponential backoff
+    max_retries = 3
+    retry_delay = 1
+    improvement = None
+
+    for attempt in range(max_retries):
+        try:
+            # Hold a slot only for the call itself, not while backing off
+            async with IMPROVEMENT_SEMAPHORE:
+                improvement = await _invoke_bedrock_claude(
+                    IMPROVEMENT_SYSTEM_PROMPT,
+                    [{"role": "user", "content": prompt}],
+                    max_tokens
+                )
+            break  # Success, exit retry loop
+        except HTTPException as http_err:
+            if http_err.status_code == 429 and attempt < max_retries - 1:
+                # Rate limit hit, wait and retry
+                logger.warning("Rate limit hit for %s, retrying in %ds...", label, retry_delay)
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+            else:
+                raise
+        except Exception as e:
+            if attempt < max_retries - 1:
+                logger.warning("Attempt %d failed for %s: %s, retrying...", attempt + 1, label, e)
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2
+            else:
+                raise
+
+    if not improvement:
+        raise Exception("Failed after all retries")
+    return improvement
+
+# Case-insensitive scan in place; .upper() copied the whole reply just to search it
+_NEEDS_IMPROVEMENT_RE = re.compile("NEEDS_IMPROVEMENT", re.IGNORECASE)
+
+def _improvement_result(therapist_msg: str, patient_response: str, improvement: str) -> Dict:
+    return {
+        "therapist_message": therapist_msg,
+        "patient_response": patient_response,
+        "improvement": improvement,
+        "needs_improvement": _NEEDS_IMPROVEMENT_RE.search(improvement) is not None
+    }
+
+def _cached_improvement(cache_key: str) -> Optional[str]:
+    if not redis_client:
+        return None
+    try:
+        return redis_client.get(cache_key)
+    except redis.RedisError as e:
+        logger.warning("Improvement cache read failed: %s", e)
+        return None
+
+def _store_improvement(cache_key: str, improvement: str) -> None:
+    if redis_client:
+        try:
+            redis_client.setex(cache_key, IMPROVEMENT_CACHE_TTL, improvement)
+        except redis.RedisError as e:
+            logger.warning("Improvement cache write failed: %s", e)
+
+async def _generate_improvement(i: int, therapist_msg: str, patient_response: str, context: str) -> Dict:
+    """One improvement call with retry/backoff; never raises, falls back to a canned note"""
+    cache_key = _improvement_cache_key(therapist_msg, patient_response, context)
+    cached = _cached_improvement(cache_key)
+    if cached:
+        return _improvement_result(therapist_msg, patient_response, cached)
+
+    try:
+        improvement = await _invoke_improvement(
+            create_improvement_prompt(therapist_msg, patient_response, context),
+            MAX_TOKENS_IMPROVEMENT, f"message {i}"
+        )
+        _store_improvement(cache_key, improvement)
+        return _improvement_result(therapist_msg, patient_response, improvement)
+
+    except Exception as e:
+        error_msg = str(e)
+        logger.error("Failed to generate improvement for message %d after retries: %s", i, error_msg)
+        return {
+            "therapist_message": therapist_msg,
+            "patient_response": patient_response,
+            "improvement": _improvement_fallback(error_msg),
+            "needs_improvement": False
+        }
+
+def _parse_improvement_batch(raw: str) -> Dict[int, str]:
+    """Model JSON array -> {item index: text in the single-call STATUS/ANALYSIS/SUGGESTION format}"""
+    start, end = raw.find("["), raw.rfind("]")
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = fast_loads(raw[start:end + 1])
+    except ValueError:
+        return {}
+    parsed = {}
+    for item in items if isinstance(items, list) else ():
+        if not isinstance(item, dict) or not isinstance(item.get("i"), int):
+            continue
+        status = str(item.get("status", "")).strip().upper()
+        if status not in ("GOOD", "NEEDS_IMPROVEMENT"):
+            continue
+        parsed[item["i"]] = (
+            f"STATUS: {status}\n"
+            f"ANALYSIS: {item.get('analysis', '')}\n"
+            f"SUGGESTION: {item.get('suggestion') or 'No changes needed.'}"
+        )
+    return parsed
+
+async def _generate_improvement_batch(turns: List[tuple]) -> List[Dict]:
+    """Improvements for up to IMPROVEMENT_BATCH_SIZE turns in one call, same order as turns.
+
+    Cache hits skip the call; items the model drops or garbles go through
+    the single-call path, so this never raises either."""
+    results: List[Optional[Dict]] = [None] * len(turns)
+    misses = []
+    for k, (i, therapist_msg, patient_response, context) in enumerate(turns):
+        cache_key = _improvement_cache_key(therapist_msg, patient_response, context)
+        cached = _cached_improvement(cache_key)
+        if cached:
+            results[k] = _improvement_result(therapist_msg, patient_response, cached)
+        else:
+            misses.append((k, cache_key))
 
-    reply = await _invoke_bedrock_claude(system_prompt, messages, MAX_TOKENS_CHAT)
-    print(f"Reply: {time.time()-start:.2f}s | Context: {len(messages)} msgs, ~{count_tokens(json.dumps(messages))} tokens")
-    return {"reply": reply}
+    parsed = {}
+    if len(misses) > 1:
+        try:
+            raw = await _invoke_improvement(
+                create_improvement_batch_prompt([turns[k] for k, _ in misses]),
+                MAX_TOKENS_IMPROVEMENT_BATCH, f"messages {turns[misses[0][0]][0]}-{turns[misses[-1][0]][0]}"
+            )
+            parsed = _parse_improvement_batch(raw)
+        except Exception as e:
+            logger.warning("Batched improvement call failed, using single calls: %s", e)
+
+    singles = []
+    for n, (k, cache_key) in enumerate(misses):
+        _, therapist_msg, patient_response, _ = turns[k]
+        if n in parsed:
+            _store_improvement(cache_key, parsed[n])
+            results[k] = _improvement_result(therapist_msg, patient_response, parsed[n])
+        else:
+            singles.append(k)
+    for k, result in zip(singles, await asyncio.gather(*(_generate_improvement(*turns[k]) for k in singles))):
+        results[k] = result
+    return results
 
 @app.post("/generate_report")
 async def generate_report(request: ReportRequest, current_user: str = Depends(get_current_user)):
+    """Stream NDJSON: one line per improvement as each finishes, and the rendered report"""
     start = time.time()
-    
-    # Generate main report
-    prompt = create_report_prompt(request.transcript)
-    report = await _invoke_bedrock_claude(
-        "Concise therapy evaluator.",
-        [{"role": "user", "content": prompt}],
-        MAX_TOKENS_REPORT
-    )
-    
-    # NEW: Generate improvement suggestions for each therapist message (if chat_history provided)
-    improvements = []
-    
-    if request.chat_history:
-        chat_history = request.chat_history
-        
-        for i in range(len(chat_history)):
-            msg = chat_history[i]
-            if msg['role'] == 'user':  # Therapist message
-                # Get patient's response (next message)
-                patient_response = ""
-                if i + 1 < len(chat_history) and chat_history[i + 1]['role'] == 'assistant':
-                    patient_response = chat_history[i + 1]['content']
-                
-                # Get context (previous 2 messages)
-                context = ""
-                if i > 0:
-                    context = " | ".join([f"{chat_history[j]['role']}: {chat_history[j]['content'][:100]}" 
-                                         for j in range(max(0, i-2), i)])
-                
-                try:
-                    improvement_prompt = create_improvement_prompt(
-                        msg['content'], 
-                        patient_response, 
-                        context
-                    )
-                    
-                    # Add retry logic with exponential backoff
-                    max_retries = 3
-                    retry_delay = 1
-                    improvement = None
-                    
-                    for attempt in range(max_retries):
-                        try:
-                            improvement = await _invoke_bedrock_claude(
-                                "Expert therapy supervisor providing constructive feedback.",
-                                [{"role": "user", "content": improvement_prompt}],
-                                MAX_TOKENS_IMPROVEMENT
-                            )
-                            break  # Success, exit retry loop
-                        except HTTPException as http_err:
-                            if http_err.status_code == 429 and attempt < max_retries - 1:
-                                # Rate limit hit, wait and retry
-                                print(f"Rate limit hit for message {i}, retrying in {retry_delay}s...")
-                                await asyncio.sleep(retry_delay)
-                                retry_delay *= 2  # Exponential backoff
-                            else:
-                                raise
-                        except Exception as e:
-                            if attempt < max_retries - 1:
-                                print(f"Attempt {attempt + 1} failed for message {i}: {e}, retrying...")
-                                await asyncio.sleep(retry_delay)
-                                retry_delay *= 2
-                            else:
-                                raise
-                    
-                    if improvement:
-                        # Parse the structured response
-                        needs_improvement = "NEEDS_IMPROVEMENT" in improvement.upper()
-                        
-                        improvements.append({
-                            "therapist_message": msg['content'],
-                            "patient_response": patient_response,
-                            "improvement": improvement,
-                            "needs_improvement": needs_improvement
-                        })
-                    else:
-                        raise Exception("Failed after all retries")
-                        
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"Failed to generate improvement for message {i} after retries: {error_msg}")
-                    
-                    # Provide a more helpful fallback message
-                    fallback = "Unable to generate detailed analysis at this time. "
-                    if "rate limit" in error_msg.lower() or "429" in error_msg:
-                        fallback += "The AI service is currently busy. This response will be analyzed in the summary above."
-                    elif "timeout" in error_msg.lower():
-                        fallback += "The analysis request timed out. Your overall performance is covered in the main report."
-                    else:
-                        fallback += "Please refer to the overall evaluation above for guidance on this exchange."
-                    
-                    improvements.append({
-                        "therapist_message": msg['content'],
-                        "patient_response": patient_response,
-                        "improvement": fallback,
-                        "needs_improvement": False
-                    })
-                
-                # Small delay between API calls to avoid rate limiting
-                if i < len(chat_history) - 1:
-                    await asyncio.sleep(0.5)
-    
-    print(f"Report + Improvements: {time.time()-start:.2f}s")
-    return {
-        "report": report,
-        "improvements": improvements
-    }
+
+    async def improvement_lines(offset: int, batch: List[tuple]) -> List[Dict]:
+        results = await _generate_improvement_batch(batch)
+        return [{"type": "improvement", "index": offset + k, "data": result} for k, result in enumerate(results)]
+
+    # The scaffold is filled from the whole JSON object, so the report is one
+    # plain call; the improvements are what arrive line by line while it runs
+    async def report_lines() -> List[Dict]:
+        try:
+            raw = await _invoke_bedrock_claude(
+                "Concise therapy evaluator.",
+                [{"role": "user", "content": create_report_prompt(request.transcript)}],
+                MAX_TOKENS_REPORT
+            )
+        except HTTPException as e:
+            logger.error("Report failed: %s", e.detail)
+            return [{"type": "error", "data": e.detail}]
+        return [{"type": "report_html", "data": render_report(raw)}]
+
+    # Improvements start right away, one call per batch of turns, alongside the report
+    turns = list(_therapist_turns(request.chat_history or []))
+    tasks = [asyncio.create_task(report_lines())] + [
+        asyncio.create_task(improvement_lines(offset, turns[offset:offset + IMPROVEMENT_BATCH_SIZE]))
+        for offset in range(0, len(turns), IMPROVEMENT_BATCH_SIZE)
+    ]
+
+    def line(obj) -> bytes:
+        return fast_dumps(obj) + b"\n"
+
+    async def ndjson():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for obj in await next_done:
+                    yield line(obj)
+            yield line({"type": "done"})
+            logger.info("Report + Improvements: %.2fs", time.time() - start)
+        finally:
+            # Client went away mid-stream: don't leave Bedrock calls running for nobody
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 # --- ADMIN ENDPOINTS ---
 @app.get("/loginlist", response_class=HTMLResponse)
@@ -1216,65 +1759,79 @@ async def login_list(request: Request):
     """Admin page to view all registered users"""
     return templates.TemplateResponse("loginlist.html", {"request": request})
 
+def _iter_user_rows(columns: str, batch_size: int = 500):
+    """Yield user rows in insertion order from a private read-only connection.
+
+    WAL lets this read run alongside writes on the shared connection, so
+    a long listing never holds USER_DB_LOCK.
+    """
+    conn = sqlite3.connect(f"file:{USER_DB_FILE}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        cursor = conn.execute(f"SELECT {columns} FROM users ORDER BY rowid")
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield from batch
+    finally:
+        conn.close()
+
 @app.get("/api/users")
 async def get_users():
-    """API endpoint to fetch all users"""
-    if not os.path.exists(USER_DB_FILE):
-        return {"users": []}
-
-    users = []
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            users.append({
-                'email': row['email'],
-                'full_name': row['full_name'],
-                'created_at': row['created_at'],
-                'password_hash': row['password_hash'][:10] + '...'
+    """API endpoint to fetch all users, streamed as one JSON object"""
+    def users_json():
+        yield b'{"users":['
+        total = 0
+        for email, full_name, created_at, hash_prefix in _iter_user_rows(
+            "email, full_name, created_at, substr(password_hash, 1, 10)"
+        ):
+            yield (b',' if total else b'') + fast_dumps({
+                'email': email,
+                'full_name': full_name,
+                'created_at': created_at,
+                'password_hash': hash_prefix + '...'
             })
+            total += 1
+        yield b'],"total":%d}' % total
 
-    return {"users": users, "total": len(users)}
+    # Sync generator: Starlette pulls it from a worker thread, off the event loop
+    return StreamingResponse(users_json(), media_type="application/json")
 
 @app.get("/api/download_users_csv")
 async def download_users_csv():
-    """Download the complete users.csv file"""
-    if not os.path.exists(USER_DB_FILE):
-        raise HTTPException(404, "User database not found")
-    return FileResponse(
-        USER_DB_FILE,
+    """Download all users as CSV, written row by row from SQLite"""
+    def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        rows = _iter_user_rows("email, password_hash, full_name, created_at")
+        for row in chain([USER_FIELDS], rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    filename = f"users_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return StreamingResponse(
+        csv_lines(),
         media_type="text/csv",
-        filename=f"users_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 # --- DELETE USER ---
 def delete_user(email: str) -> bool:
     """Delete a user by email. Returns True if deleted."""
-    if not os.path.exists(USER_DB_FILE):
-        return False
-
-    users = []
-    deleted = False
-
-    with open(USER_DB_FILE, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['email'] == email:
-                deleted = True
-                continue
-            users.append(row)
+    redis_deleted = bool(redis_client.delete(_user_key(email))) if redis_client else False
 
-    if deleted:
-        with open(USER_DB_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['email', 'password_hash', 'full_name', 'created_at'])
-            writer.writeheader()
-            writer.writerows(users)
+    with USER_DB_LOCK, user_db:
+        deleted = user_db.execute("DELETE FROM users WHERE email = ?", (email,)).rowcount > 0
 
-    return deleted
+    return deleted or redis_deleted
 
 @app.delete("/api/delete_user/{email}")
 async def delete_user_endpoint(email: str):
     """API: Delete user by email"""
-    if not delete_user(email):
+    # SQLite commit + fsync is blocking disk I/O; keep it off the event loop
+    if not await asyncio.to_thread(delete_user, email):
         raise HTTPException(status_code=404, detail="User not found")
 
     return {"success": True, "message": "User deleted successfully"}
@@ -1,486 +1,176 @@
+"""Report prompt builder: prompt_template.txt with one transcript slot.
+
+The template is read and split on first use, then joined per call. If it
+grows more fields (supervisee, level, date), compile it once as a Jinja
+template the way main.py builds report_env, instead of chaining replaces.
+"""
+import re
+import sys
+from bisect import bisect_right
+from functools import cache, lru_cache
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+# Sentinel rather than a brace field, so example JSON/markup in the rubric can't collide
+TRANSCRIPT_MARKER = "__TRANSCRIPT__"
+TRANSCRIPT_TOKENS = 750   # what the 3000-char cap held for plain English dialogue
+TRANSCRIPT_CHARS = 3000
+
+
+# Every builder below (str, bytes, writer, chat messages) reads these same parts,
+# so each process holds one copy of the rubric however the prompt is emitted
+class _PromptParts(NamedTuple):
+    prefix: str
+    suffix: str
+    truncated_suffix: str  # the ellipsis rides on the suffix, so a cut transcript isn't copied again
+    rubric: str            # prefix without the trailing "TRANSCRIPT:" lead
+    user_lead: str
+
+
+@cache
+def _template() -> _PromptParts:
+    """Read, check and split prompt_template.txt on first use; importing the module costs nothing."""
+    text = Path(__file__).with_name("prompt_template.txt").read_text(encoding="utf-8")
+    if text.count(TRANSCRIPT_MARKER) != 1:
+        raise ValueError(f"prompt_template.txt must contain {TRANSCRIPT_MARKER} exactly once")
+    # Split once: joining the halves benchmarks ~20x faster than
+    # `text.replace(TRANSCRIPT_MARKER, t, 1)`, which re-scans the whole template per call.
+    # Interned: one canonical copy per process (survives importlib.reload), comparable by identity
+    prefix, _, suffix = text.partition(TRANSCRIPT_MARKER)
+    prefix, suffix = sys.intern(prefix), sys.intern(suffix)
+    rubric, _, user_lead = prefix.rpartition("\n\n")
+    return _PromptParts(prefix, suffix, "..." + suffix, rubric, user_lead)
+
+
+@cache
+def _template_bytes() -> tuple:
+    """UTF-8 of (prefix, suffix, truncated suffix), encoded once for byte-oriented callers."""
+    parts = _template()
+    return tuple(part.encode("utf-8") for part in (parts.prefix, parts.suffix, parts.truncated_suffix))
+
+
+# --- TOKEN BUDGET (tiktoken when available, the character cap otherwise) ---
+@cache
+def _encoder():
+    # Loading the BPE ranks is the slowest part of setup; only pay it when a prompt is built
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+# Spoken fillers carry no evidence for any competency; stopwords stay, since
+# the rubric rates phrasing and tone and needs the exchanges verbatim.
+# Case-sensitive (lower case or a leading capital) and at least two letters, so
+# clinical abbreviations like "ER", "UM" or "HM" are never taken for fillers.
+# "mm-hmm"/"uh-huh" go as one token, and the filler takes its trailing
+# punctuation run and space with it, so "Uh... " or "Hm? " leaves nothing behind
+_FILLER_RE = re.compile(
+    r"\b(?=[UuEeHhMm])(?:[Mm]m+-[Hh]m+|[Uu]h+-[Hh]uh|[Uu]u*h+|[Uu]u*m+|[Ee]e*r+m+|[Hh]h*m+|[Mm]m+)\b"
+    r"(?:\.{3}|[,.?!\u2026])?\s*"
+)
+
+# A sentence runs to its closing punctuation, or to the line end for unpunctuated turns
+_SENT_RE = re.compile(r"[^.!?\n]*(?:[.!?]+|\n|$)\s*")
+
+# Enough condensed text for any token budget: real dialogue never averages this many chars per token
+_MAX_CHARS_PER_TOKEN = 16
+
+
+def _sentence_prefix(text: str, limit: int) -> str:
+    """Longest run of whole sentences of text within limit chars (may be empty)."""
+    end = 0
+    for m in _SENT_RE.finditer(text):
+        if m.end() > limit:
+            break
+        end = m.end()
+    return text[:end].rstrip()
+
+
+def _trim_transcript(transcript: str, limit: int) -> tuple:
+    """(condensed transcript of whole sentences within limit chars, whether it was cut)
+
+    One pass over the lines does all the cleanup: fillers dropped, whitespace
+    runs collapsed (str.split/join, in C), blank lines removed with each turn
+    kept on its own line. It stops as soon as the budget is full, so a long
+    transcript is never condensed past what the prompt can hold.
+    """
+    kept = []
+    size = -1  # no separator before the first line
+    for line in transcript.splitlines():
+        line = " ".join(_FILLER_RE.sub("", line).split())
+        if not line:
+            continue
+        if size + 1 + len(line) > limit:
+            head = _sentence_prefix(line, limit - size - 1)
+            if head:
+                kept.append(head)
+            elif not kept:
+                kept.append(line[:limit])  # the very first sentence is over budget: hard cut
+            return "\n".join(kept), True
+        kept.append(line)
+        size += 1 + len(line)
+    return "\n".join(kept), False
+
+
+def _cut_at_sentence_tokens(enc, text: str, ids: List[int], limit: int) -> str:
+    """Longest run of whole sentences within limit tokens; token-level cut only if the first is longer."""
+    sentences = [m.group() for m in _SENT_RE.finditer(text)]
+    counts = [len(tokens) for tokens in enc.encode_ordinary_batch(sentences)]
+    keep = bisect_right(list(accumulate(counts)), limit)
+    return "".join(sentences[:keep]).rstrip() or enc.decode(ids[:limit])
+
+
+def _fit_transcript(transcript: str) -> tuple:
+    """(transcript text for the prompt, whether it was cut)"""
+    enc = _encoder()
+    if enc is None:
+        return _trim_transcript(transcript, TRANSCRIPT_CHARS)
+    text, cut = _trim_transcript(transcript, TRANSCRIPT_TOKENS * _MAX_CHARS_PER_TOKEN)
+    ids = enc.encode_ordinary(text)
+    if len(ids) > TRANSCRIPT_TOKENS:
+        return _cut_at_sentence_tokens(enc, text, ids, TRANSCRIPT_TOKENS), True
+    return text, cut
+
+
+# Regenerate / retry resubmits the same transcript; ~20 KB per entry
+@lru_cache(maxsize=128)
 def create_report_prompt(transcript: str) -> str:
-    t = transcript[:3000] + ("..." if len(transcript) > 3000 else "")
-    return f"""Prompt: Clinical Supervision Competency Report Generator
+    parts = _template()
+    t, cut = _fit_transcript(transcript)
+    return "".join((parts.prefix, t, parts.truncated_suffix if cut else parts.suffix))
 
-You are an experienced clinical supervisor tasked with evaluating a supervisee's clinical competency and generating a comprehensive Clinical Supervision Competency Summary Report.
 
-Your Task
+def create_report_prompt_bytes(transcript: str) -> bytes:
+    """create_report_prompt(transcript).encode("utf-8"), without re-encoding the rubric."""
+    prefix, suffix, truncated_suffix = _template_bytes()
+    t, cut = _fit_transcript(transcript)
+    return b"".join((prefix, t.encode("utf-8"), truncated_suffix if cut else suffix))
 
-Based on the supervisee information, session observations, and behavioral evidence provided, you will:
 
-1. Rate each of the 15 clinical competencies using the 1-5 scale
-2. Complete all sections of the Clinical Supervision Competency Summary Report
-3. Provide specific behavioral evidence to support all ratings
-4. Identify strengths and areas for development
-5. Create actionable training goals and an implementation plan
+def write_report_prompt(w, transcript: str) -> None:
+    """Write the prompt piecewise to anything with .write(str), without building the whole string."""
+    parts = _template()
+    t, cut = _fit_transcript(transcript)
+    w.write(parts.prefix)
+    w.write(t)
+    w.write(parts.truncated_suffix if cut else parts.suffix)
 
----
 
-RATING SCALE
+def report_system_rubric() -> str:
+    """Everything ahead of "TRANSCRIPT:": the fixed rubric, identical on every call."""
+    return _template().rubric
 
-Score 1 - Needs major improvement / missing skill
-Meaning: Frequently omits skill, errors, client safety/rapport compromised
 
-Score 2 - Emerging skill, inconsistent, needs support
-Meaning: Attempts skill but inconsistent, needs prompting, misses key pieces
+def create_report_messages(transcript: str) -> List[Dict[str, str]]:
+    """The same prompt as chat messages: rubric as the system turn, transcript as the user turn.
 
-Score 3 - Meets expected level for role
-Meaning: Performs skill reliably, occasional gaps that do not affect therapy
-
-Score 4 - Strong skill, mostly independent
-Meaning: Consistently effective, anticipates needs, minimal supervisor input
-
-Score 5 - Advanced mastery, highly consistent, models skill
-Meaning: Models skill, flexible + fluent application, enhances therapy process
-
----
-
-THE 15 COMPETENCIES TO EVALUATE
-
-# 1. Rapport & Alliance
-
-What It Measures: Trust, safety, therapeutic relationship
-
-Observable Indicators / Evaluation Parameters: Greets warmly; uses client's name; maintains gentle tone; shows respect; checks comfort; collaborative stance; maintains non-judgment; attuned responses
-
-Rating Anchors:
-- Score 1: Flat/tense tone, avoids eye contact, appears distracted, client guarded
-- Score 2: Basic warmth but inconsistent attunement, forced or rehearsed rapport
-- Score 3: Warm, respectful, open body language, client comfortable
-- Score 4: Highly attuned, repairs ruptures, creates strong comfort quickly
-- Score 5: Deep trust evident, client highly engaged, strong safe therapeutic bond
-
----
-
-# 2. Empathic Communication
-
-What It Measures: Emotional attunement & reflection
-
-Observable Indicators / Evaluation Parameters: Reflects feelings accurately; uses validating language; pauses to understand; notices non-verbals; responds to emotion not only content
-
-Rating Anchors:
-- Score 1: Interrupts client, dismisses emotion, focuses only on content
-- Score 2: Attempts reflection but inaccurate/robotic, misses emotional cues
-- Score 3: Reflects emotion + content accurately, validates client
-- Score 4: Picks nuanced emotional layers, uses silence effectively
-- Score 5: Deeply attuned, facilitates emotional insight naturally
-
----
-
-# 3. Boundaries & Ethics
-
-What It Measures: Professional conduct
-
-Observable Indicators / Evaluation Parameters: Keeps time; avoids dual relationships; appropriate self-disclosure; maintains confidentiality; avoids over-involvement
-
-Rating Anchors:
-- Score 1: Blurred boundaries, inappropriate disclosure, time violations
-- Score 2: Understands boundaries but inconsistent adherence
-- Score 3: Maintains limits, confidentiality, professional tone
-- Score 4: Proactively manages boundaries, transparent ethical stance
-- Score 5: Models ethical professionalism, addresses boundary concerns immediately
-
----
-
-# 4. Session Structure & Flow
-
-What It Measures: Organizing and holding space
-
-Observable Indicators / Evaluation Parameters: Sets agenda; reviews goals; manages transitions; tracks time; summarizes; avoids tangents; provides closure
-
-Rating Anchors:
-- Score 1: No structure, loses focus, poor time management
-- Score 2: Attempted structure, frequent redirection needed
-- Score 3: Agenda set, pacing adequate, session ends with brief plan
-- Score 4: Clear flow, smooth transitions, grounded closure
-- Score 5: Highly strategic flow, anticipates pacing, session feels purposeful + contained
-
----
-
-# 5. Assessment & Questioning
-
-What It Measures: Information gathering
-
-Observable Indicators / Evaluation Parameters: Balanced open/closed questions; clarifies unclear points; explores symptoms thoroughly; uses probing when appropriate; avoids leading questions
-
-Rating Anchors:
-- Score 1: Superficial questions, misses core information, leading questions
-- Score 2: Gathers info but disorganized or over-reliant on closed questions
-- Score 3: Functional, clinically relevant questioning, adequate depth
-- Score 4: Systematic, thorough, responsive probing
-- Score 5: Advanced interview skill; integrates observation + nuance seamlessly
-
----
-
-# 6. Case Conceptualization
-
-What It Measures: Clinical meaning-making
-
-Observable Indicators / Evaluation Parameters: Identifies themes/patterns; links thoughts-emotions-behavior; integrates background; hypotheses grounded in theory; adjusts conceptualization as info emerges
-
-Rating Anchors:
-- Score 1: No clear framework, inaccurate interpretations
-- Score 2: Basic understanding, struggles to link symptoms & theory
-- Score 3: Logical, theory-guided, links T-E-B patterns
-- Score 4: Dynamic formulation, integrates new information fluidly
-- Score 5: Highly coherent formulation guiding elegant intervention choices
-
----
-
-# 7. Goal-Setting & Treatment Planning
-
-What It Measures: Direction & alignment
-
-Observable Indicators / Evaluation Parameters: Co-creates goals; goals measurable; aligns interventions to goals; checks client consent on direction; revisits progress
-
-Rating Anchors:
-- Score 1: No goals, vague direction
-- Score 2: Sets goals but not measurable, therapist-led
-- Score 3: Collaborative measurable goals, aligned with client needs
-- Score 4: Tracks progress, adapts goals, strong client agency
-- Score 5: Client deeply engaged, goals integrated naturally, ongoing evaluation
-
----
-
-# 8. Intervention Skills
-
-What It Measures: Proper technique use
-
-Observable Indicators / Evaluation Parameters: Chooses evidence-based tools; explains rationale; checks understanding; applies skill correctly; tailors to client; observes readiness
-
-Rating Anchors:
-- Score 1: Incorrect/unsafe interventions, no rationale
-- Score 2: Attempts techniques but mechanical or mismatched
-- Score 3: Correct technique, clear rationale, appropriate timing
-- Score 4: Fluent technique use, adjusts to client readiness
-- Score 5: Seamless, creative application, high client response
-
----
-
-# 9. Managing Resistance & Affect
-
-What It Measures: Handling distress, avoidance, conflict
-
-Observable Indicators / Evaluation Parameters: Names emotions gently; normalizes protective defenses; uses de-escalation; slows pace when overwhelmed; maintains calm presence
-
-Rating Anchors:
-- Score 1: Avoids emotional distress, escalates conflict
-- Score 2: Notices discomfort but unsure how to respond
-- Score 3: Names emotions, slows pace, normalizes reaction
-- Score 4: Skillfully holds intense affect, gentle de-escalation
-- Score 5: Resolves ruptures smoothly, builds insight through emotion
-
----
-
-# 10. Cultural Sensitivity
-
-What It Measures: Inclusivity & cultural awareness
-
-Observable Indicators / Evaluation Parameters: Uses inclusive language; avoids assumptions; invites client's cultural meaning; adapts interventions when culture relevant
-
-Rating Anchors:
-- Score 1: Stereotypes or assumptions, cultural blind spots
-- Score 2: Awareness present but unsure how to apply
-- Score 3: Respectful, asks cultural meaning, avoids assumptions
-- Score 4: Culturally attuned adaptation of interventions
-- Score 5: Deep cultural humility, integrates context effortlessly
-
----
-
-# 11. Ethical Practice
-
-What It Measures: Safety, informed consent, documentation
-
-Observable Indicators / Evaluation Parameters: Introduces confidentiality & limits; safety questions when needed; reports risks; maintains clinical records accurately
-
-Rating Anchors:
-- Score 1: Ethical breaches, confidentiality lapses
-- Score 2: Basic ethics but misses risk screening or forgets boundaries
-- Score 3: Follows ethical guidelines, informed consent routine
-- Score 4: Identifies ethical dilemmas early, consults when needed
-- Score 5: Ethical leader; prevents risk, educates clients, excellent judgement
-
----
-
-# 12. Clinical Judgment
-
-What It Measures: Decision-making capacity
-
-Observable Indicators / Evaluation Parameters: Prioritizes presenting issues; identifies risk; knows scope; seeks supervision appropriately; avoids premature conclusions
-
-Rating Anchors:
-- Score 1: Poor prioritization, unsafe decisions
-- Score 2: Understands basics but inconsistent judgement
-- Score 3: Prioritizes appropriately, recognizes risk cues
-- Score 4: Strong reasoning, anticipates challenges
-- Score 5: Excellent judgement, clinical intuition backed by theory
-
----
-
-# 13. Documentation Quality
-
-What It Measures: Professional note-taking
-
-Observable Indicators / Evaluation Parameters: Notes accurate, objective, timely; includes presenting concerns, interventions, observations, plan; follows format (SOAP/DAP)
-
-Rating Anchors:
-- Score 1: Missing or unsafe notes, subjective, disorganized
-- Score 2: Notes incomplete or vague
-- Score 3: Clear, timely, objective notes following structure
-- Score 4: Detailed, concise, intervention-focused
-- Score 5: Model-level documentation — measurable outcomes, risk notation, clear plan
-
----
-
-# 14. Reflective Practice
-
-What It Measures: Insight & growth
-
-Observable Indicators / Evaluation Parameters: Recognizes limitations; self-evaluates; invites feedback; adjusts behavior; remarks on personal reactions
-
-Rating Anchors:
-- Score 1: Defensive, unaware of limitations
-- Score 2: Acknowledges issues but limited insight or change
-- Score 3: Open to feedback, names growth areas
-- Score 4: Integrates feedback consistently
-- Score 5: Deep reflective capacity, uses insight proactively
-
----
-
-# 15. Professionalism
-
-What It Measures: Conduct & responsibility
-
-Observable Indicators / Evaluation Parameters: Punctual; prepared; respectful; follows through on tasks; maintains appropriate demeanor; appropriate attire
-
-Rating Anchors:
-- Score 1: Unprepared, late, disorganized
-- Score 2: Inconsistently professional
-- Score 3: Reliable, timely, prepared
-- Score 4: Highly dependable, self-directed
-- Score 5: Professional role-model, consistently exceeds expectations
-
----
-
-EVALUATION METHODOLOGY
-
-Step 1: Review All Evidence
-
-Carefully read all provided information about the supervisee including session transcripts or descriptions, supervisor observations, client interactions, documentation samples, self-reflection statements, and previous feedback.
-
-Step 2: Rate Each Competency
-
-For each of the 15 competencies:
-1. Identify relevant behavioral evidence from the materials
-2. Match observed behaviors to the rating anchors (1-5)
-3. Consider consistency - one good moment does not equal consistent competency
-4. Account for training level - adjust expectations appropriately
-5. Assign the rating that best fits the overall pattern
-
-Step 3: Calculate Average Score
-
-Sum all 15 ratings, divide by 15, and round to one decimal place.
-
-Step 4: Determine Overall Level
-
-Based on average score:
-- 1.0 to 1.9: Needs Remediation
-- 2.0 to 2.9: Emerging
-- 3.0 to 3.9: Competent
-- 4.0 to 4.9: Strong
-- 5.0: Advanced
-
----
-
-REPORT SECTIONS TO COMPLETE
-
-# Section 1: Overall Competency Summary
-
-List all 15 competencies with their numerical ratings. Calculate and display average competency score. Check appropriate overall level: Needs Remediation, Emerging, Competent, Strong, or Advanced.
-
-# Section 2: Strengths Demonstrated
-
-Focus on observable behaviours. Provide at least 4 specific strengths.
-
-Requirements:
-- Focus on scores of 4-5
-- Use behavioral language
-- Include specific examples from sessions
-- Highlight what supervisee should continue doing
-
-Format: [Competency area]: [Specific observable behavior with concrete example]
-
-Example: Empathic Communication: Consistently reflected both content and emotion, as evidenced when client discussed job loss and supervisee responded "You're not just worried about money—there's also grief about losing your professional identity."
-
-# Section 3: Areas for Development
-
-Behaviour-specific & skill-focused. Provide at least 3-4 specific areas.
-
-Requirements:
-- Focus on scores of 1-2 (and 3s that need improvement)
-- Use growth-oriented language (not deficit-focused)
-- Be specific about what to develop
-- Suggest how to improve
-
-Format: [Competency area]: [Specific skill gap with developmental recommendation]
-
-Example: Session Structure: Would benefit from setting a clear agenda at session start and providing time checks. Practice using phrases like "We have 15 minutes remaining—let's start to wrap up."
-
-# Section 4: Evidence / Supervisor Observations
-
-Concrete examples drawn from session. Provide specific behavioral examples for each of these 5 skill areas:
-
-Therapeutic Attunement: Provide specific example of empathy, rapport-building, or emotional responsiveness
-
-Therapeutic Skills: Provide specific intervention used, technique application, what they did
-
-Professional Conduct: Provide example of boundaries, time management, ethical behavior
-
-Clinical Formulation: Provide how they conceptualized the case, pattern recognition
-
-Risk & Ethics: Provide safety assessment, confidentiality, ethical decision-making example
-
-Requirements:
-- Use direct quotes or paraphrased behaviors when possible
-- Include context (what was happening in session)
-- Show both strengths AND gaps
-- Be concrete and observable
-
-# Section 5: Training Goals for Next Placement / Month
-
-Specific, measurable, time-linked goals. Provide 2-3 goals with the following information for each:
-
-Goal: What competency to develop
-
-Target Behaviour / Skill: Specific observable action
-
-Timeline: Timeframe for achievement
-
-Measure of Progress: How success will be evaluated
-
-Requirements:
-- Focus on lowest-scoring competencies (1-2 ratings)
-- Make goals Specific, Measurable, Achievable, Relevant, Time-bound
-- Include observable behavioral targets
-- Define clear success metrics
-
-Example:
-Goal: Improve Case Conceptualization
-Target Behaviour / Skill: Present case formulation linking client's anxious thoughts → physical symptoms → avoidance behaviors using CBT framework
-Timeline: Next 4 weeks
-Measure of Progress: Supervisor rates formulation as "3" or higher; supervisee can articulate T-E-B connections in 3 consecutive cases
-
-# Section 6: Action Plan
-
-Provide the following 3 subsections:
-
-Practice / assignment areas:
-List 2-3 specific activities/exercises to build skills. Include homework, role-plays, practice scenarios.
-
-Required supervision focus:
-Identify 2-3 priority topics for supervision sessions. What supervisor and supervisee will work on together.
-
-Resources recommended (readings, role-plays, shadowing):
-Suggest 2-4 concrete resources: readings, videos, training modules, shadowing opportunities. Match resources to identified development areas.
-
----
-
-OUTPUT REQUIREMENTS
-
-1. Complete all sections of the report template
-2. Use professional, objective language throughout
-3. Ground all ratings in observable evidence - no assumptions
-4. Balance developmental feedback - acknowledge strengths while addressing gaps
-5. Ensure actionability - reader should know exactly what to do next
-6. Match tone to training level - supportive for interns, higher expectations for practicing clinicians
-7. Be specific - avoid vague statements like "good rapport" without examples
-
----
-
-FORMATTING GUIDELINES - CRITICAL
-
-YOU MUST FORMAT THE REPORT USING THESE EXACT HTML TAGS FOR PROPER DISPLAY:
-
-1. Main Section Headers (e.g., "Section 1: Overall Competency Summary"):
-   Use: <h2>Section Title</h2>
-
-2. Sub-headers (e.g., "Strengths Demonstrated", competency names):
-   Use: <h3>Sub-header</h3>
-
-3. Smaller sub-sections (e.g., "Goal:", "Target Behaviour:"):
-   Use: <h4>Label</h4>
-
-4. Important emphasis (e.g., rating numbers, key terms):
-   Use: <strong>text</strong>
-
-5. Lists and bullet points:
-   Use: <ul><li>item</li></ul> for unordered lists
-   Use: <ol><li>item</li></ol> for numbered lists
-
-6. Line breaks between sections:
-   Use: <br> or <br><br> for spacing
-
-7. Horizontal dividers between major sections:
-   Use: <hr>
-
-8. For rating display, use this format:
-   <strong>1. Rapport & Alliance:</strong> 4<br>
-
-EXAMPLE OF PROPER FORMATTING:
-
-<h2>Section 1: Overall Competency Summary</h2>
-
-<h3>Competency Ratings</h3>
-<strong>1. Rapport & Alliance:</strong> 4<br>
-<strong>2. Empathic Communication:</strong> 3<br>
-<strong>3. Boundaries & Ethics:</strong> 4<br>
-[...continue for all 15...]
-
-<br>
-<strong>Average Competency Score: 3.4</strong><br>
-<strong>Overall Level: COMPETENT</strong>
-
-<hr>
-
-<h2>Section 2: Strengths Demonstrated</h2>
-
-<ul>
-<li><strong>Rapport & Alliance:</strong> Established warm connection immediately by greeting client by name and using open body language. Client appeared relaxed and engaged throughout.</li>
-<li><strong>Empathic Communication:</strong> Consistently reflected both content and emotion, as when client discussed job loss and supervisee responded "You're not just worried about money—there's also grief about losing your professional identity."</li>
-</ul>
-
-<hr>
-
-[Continue with remaining sections using proper HTML formatting]
-
-CRITICAL: Every section header MUST use <h2>, every sub-header MUST use <h3>, every list MUST use <ul><li> or <ol><li>, and every rating or important term MUST use <strong>. DO NOT use plain text for headers - the report will be unreadable.
-
----
-
-INPUT YOU WILL RECEIVE
-
-When generating the report, you will be provided with: Supervisee name and training level, Supervisor name and evaluation date, Session modality and observation source, Session description, transcript excerpts, or behavioral observations, Any relevant background information, and Documentation samples (if applicable).
-
-Based on this input, apply the evaluation criteria above to generate a complete, evidence-based Clinical Supervision Competency Summary Report.
-
----
-
-FINAL CHECKLIST
-
-Before submitting the report, verify:
-- All 15 competencies have numerical ratings (1-5)
-- Average score is calculated correctly
-- Overall level is checked appropriately
-- At least 4 specific strengths are listed with examples
-- At least 3 specific development areas are identified
-- Evidence section has concrete examples in all 5 skill areas (Therapeutic Attunement, Therapeutic Skills, Professional Conduct, Clinical Formulation, Risk & Ethics)
-- 2-3 SMART training goals are included with all components (Goal, Target Behaviour/Skill, Timeline, Measure of Progress)
-- Action plan has all 3 subsections completed (Practice/assignment areas, Required supervision focus, Resources recommended)
-- All ratings are supported by observable behavioral evidence
-- Language is professional, objective, and developmental
-- FORMATTING: All headers use proper HTML tags (<h2>, <h3>, <h4>), all lists use <ul><li> or <ol><li>, all emphasis uses <strong>, proper spacing with <br> and <hr>
-
-TRANSCRIPT:
-{t}
-
-Generate a complete Clinical Supervision Competency Summary Report following all sections and guidelines above. REMEMBER: Use proper HTML formatting tags throughout the entire report for readability."""
\ No newline at end of file
+    The system block never changes, so provider-side prompt caching can reuse it."""
+    parts = _template()
+    t, cut = _fit_transcript(transcript)
+    return [
+        {"role": "system", "content": parts.rubric},
+        {"role": "user", "content": "".join((parts.user_lead, t, parts.truncated_suffix if cut else parts.suffix))},
+    ]